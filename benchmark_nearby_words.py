@@ -0,0 +1,87 @@
+"""
+Compare NearbyWordIndex with the linear scans BasicTokenCounter used before it, on a synthetic vocabulary.
+Both must give the same answers. Reports build time and lookups per second.
+
+Usage: python benchmark_nearby_words.py [number of lemmas] [number of lookups]
+"""
+import random
+import sys
+import time
+from typing import Dict, List
+
+from nearby_words import NearbyWordIndex, get_edit_distance
+
+SYLLABLES = ['a', 'e', 'i', 'o', 'u', 'ma', 'me', 'mi', 'mo', 'pa', 'pe', 'pi', 'po', 'ta', 'te', 'ti', 'to', 'ca', 'co',
+             'cu', 'la', 'le', 'li', 'lo', 'ra', 're', 'ri', 'ro', 'sa', 'se', 'si', 'so', 'da', 'de', 'do', 'na', 'ne',
+             'no', 'ba', 'bo', 'ga', 'go', 'ción', 'mente', 'ar', 'er', 'ir', 'ado', 'ido', 'es', 'os', 'as']
+
+
+def make_vocabulary(num_words: int) -> List[str]:
+    words = set()
+    while len(words) < num_words:
+        words.add(''.join(random.choice(SYLLABLES) for _ in range(random.randint(1, 5))))
+    return sorted(words)
+
+
+def linear_has_nearby_words(by_first_2: Dict[str, List[str]], word: str) -> bool:
+    # BasicTokenCounter.has_nearby_words before NearbyWordIndex
+    if len(word) < 3:
+        return True
+    extra_letters = 2
+    if len(word) <= 4:
+        extra_letters = 1
+    l1 = len(word)
+    for other in by_first_2.get(word[:2], []):
+        l2 = len(other)
+        if abs(l2 - l1) <= extra_letters:
+            l_targ = max(l1, l2) - extra_letters
+            if other[:l_targ] == word[:l_targ]:
+                if other != word:
+                    return True
+    return False
+
+
+def benchmark_nearby_words(num_words: int, num_lookups: int):
+    random.seed(0)
+    words = make_vocabulary(num_words)
+    # half the lookups are in the vocabulary, half are new words
+    lookups = random.sample(words, num_lookups // 2) + make_vocabulary(num_lookups - num_lookups // 2)
+    print(f"{len(words)} lemmas, {len(lookups)} lookups")
+
+    start = time.time()
+    by_first_2 = {}
+    for word in words:
+        by_first_2.setdefault(word[:2], []).append(word)
+    linear_answers = [linear_has_nearby_words(by_first_2, x) for x in lookups]
+    linear_seconds = time.time() - start
+
+    start = time.time()
+    index = NearbyWordIndex(words)
+    build_seconds = time.time() - start
+    start = time.time()
+    answers = [len(x) < 3 or index.has_word_sharing_prefix(x, 2 if len(x) > 4 else 1) for x in lookups]
+    lookup_seconds = time.time() - start
+    if answers != linear_answers:
+        raise Exception("NearbyWordIndex disagrees with the linear scan")
+    print(f"shared prefix: linear {round(len(lookups) / linear_seconds)} lookups/s, "
+          f"index {round(len(lookups) / lookup_seconds)} lookups/s after {build_seconds:.2f}s to build")
+
+    edit_lookups = lookups[:200]
+    start = time.time()
+    linear_edits = [[x for x in words if get_edit_distance(word, x, 1) <= 1] for word in edit_lookups]
+    linear_seconds = time.time() - start
+    start = time.time()
+    index.get_words_within_edits(edit_lookups[0], 1)
+    build_seconds = time.time() - start
+    start = time.time()
+    edits = [index.get_words_within_edits(x, 1) for x in edit_lookups]
+    lookup_seconds = time.time() - start
+    if edits != linear_edits:
+        raise Exception("symmetric delete lookups disagree with the linear scan")
+    print(f"within 1 edit: linear {round(len(edit_lookups) / linear_seconds)} lookups/s, "
+          f"index {round(len(edit_lookups) / lookup_seconds)} lookups/s after {build_seconds:.2f}s to build")
+
+
+if __name__ == '__main__':
+    benchmark_nearby_words(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+                           int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
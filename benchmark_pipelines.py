@@ -0,0 +1,139 @@
+"""
+Compare the pipeline profiles in nlp_pipelines.py.
+For each profile this reports load time, words per second and how often lemmas, parts of speech and
+sentence starts agree with the full pipeline.
+With "sizes", the count profile of every package size is loaded in its own process instead, and this reports
+peak resident memory, load time, words per second and how often lemmas and parts of speech agree with lg.
+
+Usage: python benchmark_pipelines.py <language> [number of chapters] [sizes]
+"""
+import multiprocessing
+import resource
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from spacy.tokens import Doc
+
+from ingestion import read_book_chapters
+from nlp_pipelines import PIPELINE_PROFILES, PIPELINE_SIZES, load_nlp
+from util import get_books
+
+
+def agreement(docs: List[Doc], full_docs: List[Doc], attr: str) -> Optional[float]:
+    same = 0
+    total = 0
+    for doc, full_doc in zip(docs, full_docs):
+        for token, full_token in zip(doc, full_doc):
+            total += 1
+            if getattr(token, attr) == getattr(full_token, attr):
+                same += 1
+    if total == 0:
+        return None
+    return same / total
+
+
+def benchmark_profile(language: str, profile: str, texts: List[str]) -> Dict:
+    start = time.time()
+    nlp = load_nlp(language, profile)
+    load_seconds = time.time() - start
+
+    start = time.time()
+    docs = list(nlp.pipe(texts, batch_size=4))
+    parse_seconds = time.time() - start
+    num_words = sum(len(x) for x in docs)
+    return {'profile': profile, 'pipes': nlp.pipe_names, 'load_seconds': load_seconds,
+            'words_per_second': num_words / parse_seconds, 'docs': docs}
+
+
+def benchmark_pipelines(language: str, num_chapters: int):
+    chapters = read_book_chapters(language, get_books(language)[:1])[:num_chapters]
+    texts = [x[2] for x in chapters]
+    print(f"benchmarking {len(texts)} chapters, {sum(len(x) for x in texts)} characters")
+
+    results = [benchmark_profile(language, profile, texts) for profile in PIPELINE_PROFILES.keys()]
+    full_docs = results[0]['docs']
+    for result in results:
+        docs = result['docs']
+        has_tags = ('lemmatizer' in result['pipes'])
+        has_sents = docs[0].has_annotation("SENT_START")
+        lemma_agreement = agreement(docs, full_docs, 'lemma_') if has_tags else None
+        pos_agreement = agreement(docs, full_docs, 'pos_') if has_tags else None
+        sent_agreement = agreement(docs, full_docs, 'is_sent_start') if has_sents else None
+        print(f"{result['profile']:>10}: load {result['load_seconds']:.1f}s, "
+              f"{round(result['words_per_second'])} words/s, "
+              f"lemma {format_agreement(lemma_agreement)}, pos {format_agreement(pos_agreement)}, "
+              f"sentence starts {format_agreement(sent_agreement)}, pipes {result['pipes']}")
+
+
+def _benchmark_size_in_process(args: Tuple[str, str, List[str]]) -> Optional[Dict]:
+    # runs in a fresh process, so ru_maxrss is the peak of this pipeline alone
+    language, size, texts = args
+    try:
+        start = time.time()
+        nlp = load_nlp(language, 'count', size)
+        load_seconds = time.time() - start
+    except (ImportError, OSError):
+        return None
+    start = time.time()
+    docs = list(nlp.pipe(texts, batch_size=4))
+    parse_seconds = time.time() - start
+    # ru_maxrss is in kilobytes on linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'size': size, 'load_seconds': load_seconds, 'peak_rss_mb': peak_rss_mb,
+            'words_per_second': sum(len(x) for x in docs) / parse_seconds,
+            'lemmas': [[x.lemma_ for x in doc] for doc in docs], 'pos': [[x.pos_ for x in doc] for doc in docs]}
+
+
+def list_agreement(values: List[List[str]], full_values: List[List[str]]) -> Optional[float]:
+    same = 0
+    total = 0
+    for doc_values, full_doc_values in zip(values, full_values):
+        for value, full_value in zip(doc_values, full_doc_values):
+            total += 1
+            if value == full_value:
+                same += 1
+    if total == 0:
+        return None
+    return same / total
+
+
+def benchmark_sizes(language: str, num_chapters: int):
+    chapters = read_book_chapters(language, get_books(language)[:1])[:num_chapters]
+    texts = [x[2] for x in chapters]
+    print(f"benchmarking {len(texts)} chapters, {sum(len(x) for x in texts)} characters")
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for size in PIPELINE_SIZES:
+        with context.Pool(1) as pool:
+            result = pool.apply(_benchmark_size_in_process, ((language, size, texts),))
+        if result is None:
+            print(f"{size:>3}: not installed")
+            continue
+        results.append(result)
+
+    if len(results) == 0:
+        return
+    full_result = results[0]
+    print("agreement is with", full_result['size'])
+    for result in results:
+        print(f"{result['size']:>3}: peak rss {round(result['peak_rss_mb'])}MB, load {result['load_seconds']:.1f}s, "
+              f"{round(result['words_per_second'])} words/s, "
+              f"lemma {format_agreement(list_agreement(result['lemmas'], full_result['lemmas']))}, "
+              f"pos {format_agreement(list_agreement(result['pos'], full_result['pos']))}")
+
+
+def format_agreement(value: Optional[float]) -> str:
+    if value is None:
+        return "n/a"
+    return f"{round(value * 1000) / 10}%"
+
+
+if __name__ == '__main__':
+    benchmark_language = sys.argv[1] if len(sys.argv) > 1 else 'spanish'
+    benchmark_chapters = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    if 'sizes' in sys.argv[3:]:
+        benchmark_sizes(benchmark_language, benchmark_chapters)
+    else:
+        benchmark_pipelines(benchmark_language, benchmark_chapters)
@@ -0,0 +1,68 @@
+"""
+Compare the serializers in serializers.py on the cache files in cache/<language>.
+For each cache file and serializer this reports file size, save time and load time, so each cache class can
+use the serializer that suits it (see PicklingBaseClass.serializer).
+Shards are grouped by class, only the biggest shard of each class is measured.
+
+Usage: python benchmark_serializers.py <language> [repeats]
+"""
+import glob
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import serializers
+
+
+def best_seconds(function: Callable, repeats: int) -> float:
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def get_cache_files(language: str) -> List[Tuple[str, str]]:
+    """
+    :return: (name, path) of each cache file, with the biggest shard of each class
+    """
+    cache_path = os.path.join('cache', language)
+    files = [(os.path.basename(x)[:-len('.pickle')], x) for x in sorted(glob.glob(os.path.join(cache_path, '*.pickle')))]
+    for shard_path in sorted(glob.glob(os.path.join(cache_path, '*', ''))):
+        shards = glob.glob(os.path.join(shard_path, '*.pickle'))
+        if len(shards) > 0:
+            files.append((os.path.basename(os.path.dirname(shard_path)) + " shard", max(shards, key=os.path.getsize)))
+    return files
+
+
+def benchmark_file(path: str, repeats: int) -> List[Dict]:
+    with open(path, 'rb') as fin:
+        obj = serializers.loads(fin.read())
+    results = []
+    for serializer in serializers.get_serializers():
+        data = serializers.dumps(obj, serializer)
+        reloaded = serializers.loads(data)
+        if type(reloaded) != type(obj):
+            raise Exception(f"{serializer} read back a {type(reloaded)} instead of a {type(obj)}")
+        results.append({'serializer': serializer, 'bytes': len(data),
+                        'save_seconds': best_seconds(lambda: serializers.dumps(obj, serializer), repeats),
+                        'load_seconds': best_seconds(lambda: serializers.loads(data), repeats)})
+    return results
+
+
+def benchmark_serializers(language: str, repeats: int):
+    print("serializers:", ", ".join(serializers.get_serializers()))
+    for name, path in get_cache_files(language):
+        print(f"{name} ({os.path.getsize(path)} bytes on disk)")
+        for result in benchmark_file(path, repeats):
+            print(f"  {result['serializer']:>13}: {result['bytes'] / 1024:>9.0f}KB, "
+                  f"save {result['save_seconds'] * 1000:>7.1f}ms, load {result['load_seconds'] * 1000:>7.1f}ms")
+
+
+if __name__ == '__main__':
+    benchmark_language = sys.argv[1] if len(sys.argv) > 1 else 'spanish'
+    benchmark_repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    benchmark_serializers(benchmark_language, benchmark_repeats)
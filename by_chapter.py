@@ -1,14 +1,14 @@
 from spacy import Language as SpacyLanguage
-from bs4 import BeautifulSoup
 import os
 import csv
-from deluxe_token_counter import get_deluxe_word_count, DeluxeTokenCounter
+from frequency_table import get_frequency_table, FrequencyTable
 from lemma_lookup import LemmaLookup
 from previously_imported_words import PreviouslyImportedWords
 from util import get_books
-from ebooklib import epub
-import ebooklib
-from util import is_text_chapter, get_biggest_word
+from util import get_biggest_word
+from epub_stream import chapter_text
+from chapter_manifest import ChapterManifest
+from doc_store import DocStore
 from spacy.tokens.token import Token
 from translator import Translation
 from typing import TypedDict, List
@@ -35,7 +35,7 @@ def get_text_keys(token: Token, lemma_lookup: LemmaLookup) -> [str]:
 
 
 def should_include_token(token: Token, words_and_lemmas_seen: {}, already_imported: PreviouslyImportedWords,
-                         deluxe_word_count: DeluxeTokenCounter, lemma_lookup: LemmaLookup,
+                         deluxe_word_count: FrequencyTable, lemma_lookup: LemmaLookup,
                          min_word_frequency: int) -> bool:
     if (not token.is_alpha) or token.is_stop or (len(token.text) < 2):
         return False  # don't include stop (very common) words or non-alpha words or one-letter words
@@ -133,31 +133,30 @@ def create_chapter_words(language: str, book_number: int, start_chapter: int, nu
     """
     books = get_books(language)
     target_book_path = books[book_number-1]
-    deluxe_word_count = get_deluxe_word_count(language)
-    lemma_lookup = LemmaLookup.load('italian')
-    already_imported = PreviouslyImportedWords.load_and_update('italian', lemma_lookup)
+    deluxe_word_count = get_frequency_table(language)
+    lemma_lookup = LemmaLookup.load(language)
+    already_imported = PreviouslyImportedWords.load_and_update(language, lemma_lookup)
     words_and_lemmas_seen = {}  # words and lemmas seen now. Use in conjunction with already_imported
+    doc_store = DocStore(language, nlp)
 
     print("read book", target_book_path)
 
-    book = epub.read_epub(target_book_path)
-
-    # items = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
-    all_items = book.get_items_of_type(ebooklib.ITEM_DOCUMENT)
-    all_chapters = list(filter(lambda x: is_text_chapter(x, language), all_items))
+    # only the requested chapters are read, straight from the chapter manifest
+    manifest = ChapterManifest(language)
+    num_book_chapters = manifest.get_num_chapters(target_book_path, book_number)
+    chapters_by_number = {x.chapter: x for x in manifest.get_chapters(target_book_path, book_number,
+                                                                      start_chapter, num_chapters)}
 
     for chapter_num in range(start_chapter, start_chapter+num_chapters):
         i_chapter = chapter_num - 1
         if i_chapter < 0:
             print("minimum start_chapter is 1")
             continue
-        if i_chapter >= len(all_chapters):
-            print(f"there are only len(all_chapters). Skipping chapter index {i_chapter}")
+        if i_chapter >= num_book_chapters:
+            print(f"there are only {num_book_chapters} chapters. Skipping chapter index {i_chapter}")
             continue
-        chapter = all_chapters[i_chapter]
-        print(f"<h1>Chapter {chapter_num}: {len(chapter.get_body_content())} characters</h1>")
-        # print(chapter.get_body_content()[0:1000])
-        soup = BeautifulSoup(chapter.get_body_content(), "html.parser")
+        chapter = chapters_by_number[chapter_num]
+        print(f"<h1>Chapter {chapter_num}: {chapter.body_length} characters</h1>")
         sentences: List[SentenceTokens] = []
 
         word_count = 0
@@ -165,23 +164,22 @@ def create_chapter_words(language: str, book_number: int, start_chapter: int, nu
         total_words_seen = 0
         new_tokens_found = []
 
-        for para in soup.find_all('p'):
-            para_text = para.get_text()
-            doc = nlp(para_text)
-            for sent in doc.sents:
-                sentence: SentenceTokens = {'tokens':[], 'text':sent.text}
-                for token in sent:
-                    if should_include_token(token=token, already_imported=already_imported, lemma_lookup=lemma_lookup,
-                                            words_and_lemmas_seen=words_and_lemmas_seen,
-                                            deluxe_word_count=deluxe_word_count, min_word_frequency=min_word_frequency):
-                        sentence['tokens'].append(token)
-                        new_tokens_found.append(token)
-                        for key in get_text_keys(token, lemma_lookup):
-                            words_and_lemmas_seen[key] = True
-                    if token.is_alpha and (not token.is_stop):
-                        total_words_seen += 1
-                if len(sentence['tokens']) > 0:
-                    sentences.append(sentence)
+        # the same chapter text the word counter parsed, so the parse usually comes from the doc store
+        doc = doc_store.get_doc(chapter_text(chapter))
+        for sent in doc.sents:
+            sentence: SentenceTokens = {'tokens':[], 'text':sent.text}
+            for token in sent:
+                if should_include_token(token=token, already_imported=already_imported, lemma_lookup=lemma_lookup,
+                                        words_and_lemmas_seen=words_and_lemmas_seen,
+                                        deluxe_word_count=deluxe_word_count, min_word_frequency=min_word_frequency):
+                    sentence['tokens'].append(token)
+                    new_tokens_found.append(token)
+                    for key in get_text_keys(token, lemma_lookup):
+                        words_and_lemmas_seen[key] = True
+                if token.is_alpha and (not token.is_stop):
+                    total_words_seen += 1
+            if len(sentence['tokens']) > 0:
+                sentences.append(sentence)
 
         percent_new = str(round(1000 * len(new_tokens_found) / total_words_seen) / 10)
         print(f"finished parsing chapter {chapter_num}, found {len(new_tokens_found)} new words of {total_words_seen} ({percent_new}% new)")
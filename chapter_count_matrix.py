@@ -0,0 +1,251 @@
+from array import array
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from ingestion import register_counter, ingest, get_first_occurrences, get_doc_string, \
+    DOC_LOWER_LEMMA, DOC_IS_ALPHA, DOC_IS_STOP
+from pickling_base import PicklingBaseClass
+from string_ids import get_string_id
+from util import get_books, get_book_hash
+
+if TYPE_CHECKING:
+    from spacy.tokens import Doc, Token
+
+
+@register_counter
+class ChapterCountMatrix(PicklingBaseClass):
+    """
+    Hits of every lemma in every chapter, as a sparse lemma x chapter matrix.
+    Lemmas are counted like DeluxeTokenCounter counts them: lower case spacy lemmas of words that aren't stop words.
+    Lemma ids index the lemmas table and chapter ids index the chapters table, (book, chapter) in reading order.
+    Lemmas are looked up by their string id (see string_ids), kept for each lemma id in lemma_hashes.
+    The matrix is kept as coordinate arrays (lemma id, chapter id, hits) with one entry per lemma and chapter,
+    and is pickled as numpy arrays.
+    """
+    def __init__(self, language: str):
+        self.lemmas: List[str] = []
+        self.lemma_hashes = array('Q')
+        self.chapters: List[Tuple[int, int]] = []
+        # content hashes of the books this matrix was built from, in book order
+        self.book_hashes: List[str] = []
+        # string id -> lemma id. Not pickled, built when a lemma is looked up
+        self._lemma_ids: Optional[Dict[int, int]] = {}
+        self._chapter_ids: Dict[Tuple[int, int], int] = {}
+        self._rows = np.zeros(0, dtype=np.int32)
+        self._cols = np.zeros(0, dtype=np.int32)
+        self._counts = np.zeros(0, dtype=np.int32)
+        # (lemma id, chapter id) -> hits counted since the arrays were last updated
+        self._pending: Dict[Tuple[int, int], int] = {}
+        super().__init__(language)
+
+    def __getstate__(self):
+        self._flush()
+        state = self.__dict__.copy()
+        del state["_lemma_ids"]
+        del state["_chapter_ids"]
+        del state["_pending"]
+        # one string and two small int arrays pickle much smaller than lists of str and tuples
+        state["lemmas"] = "\n".join(self.lemmas)
+        state["chapters"] = np.array(self.chapters, dtype=np.int32).reshape(-1, 2)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lemmas = state["lemmas"].split("\n") if len(state["lemmas"]) > 0 else []
+        if "lemma_hashes" not in state:
+            # older caches only have the lemma text
+            self.lemma_hashes = array('Q', [get_string_id(x) for x in self.lemmas])
+        self.chapters = [(int(x[0]), int(x[1])) for x in state["chapters"]]
+        self._lemma_ids = None
+        self._chapter_ids = {x: i for i, x in enumerate(self.chapters)}
+        self._pending = {}
+
+    def _get_lemma_ids(self) -> Dict[int, int]:
+        if self._lemma_ids is None:
+            self._lemma_ids = {x: i for i, x in enumerate(self.lemma_hashes)}
+        return self._lemma_ids
+
+    def get_lemma_id(self, lemma: str) -> Optional[int]:
+        return self._get_lemma_ids().get(get_string_id(lemma), None)
+
+    def get_lemma_hashes(self) -> np.ndarray:
+        """
+        :return: the string id of each lemma, by lemma id
+        """
+        return np.frombuffer(self.lemma_hashes, dtype=np.uint64).copy()
+
+    def get_chapter_id(self, book: int, chapter: int) -> Optional[int]:
+        return self._chapter_ids.get((book, chapter), None)
+
+    def _add_lemma(self, lemma: str, lemma_hash: Optional[int] = None) -> int:
+        if lemma_hash is None:
+            lemma_hash = get_string_id(lemma)
+        lemma_ids = self._get_lemma_ids()
+        lemma_id = lemma_ids.get(lemma_hash, None)
+        if lemma_id is None:
+            lemma_id = len(self.lemmas)
+            self.lemmas.append(lemma)
+            self.lemma_hashes.append(lemma_hash)
+            lemma_ids[lemma_hash] = lemma_id
+        return lemma_id
+
+    def _add_chapter(self, book: int, chapter: int) -> int:
+        chapter_id = self._chapter_ids.get((book, chapter), None)
+        if chapter_id is None:
+            chapter_id = len(self.chapters)
+            self.chapters.append((book, chapter))
+            self._chapter_ids[(book, chapter)] = chapter_id
+        return chapter_id
+
+    def add(self, token: 'Token', book: int, chapter: int):
+        if (not token.is_alpha) or token.is_stop:
+            return
+        key = (self._add_lemma(token.lemma_.lower()), self._add_chapter(book, chapter))
+        self._pending[key] = self._pending.get(key, 0) + 1
+
+    def add_token(self, token: 'Token', book: int, chapter: int):
+        self.add(token, book, chapter)
+
+    def add_doc(self, doc: 'Doc', doc_array: np.ndarray, book: int, chapter: int):
+        """
+        Same as add for every token of a doc, with the hits counted by numpy.
+        """
+        indexes = np.flatnonzero((doc_array[:, DOC_IS_ALPHA] == 1) & (doc_array[:, DOC_IS_STOP] == 0))
+        if len(indexes) == 0:
+            return
+        lemma_hashes, _, counts = get_first_occurrences(doc_array[indexes, DOC_LOWER_LEMMA])
+        chapter_id = self._add_chapter(book, chapter)
+        for lemma_hash, count in zip(lemma_hashes.tolist(), counts.tolist()):
+            lemma_id = self._get_lemma_ids().get(lemma_hash, None)
+            if lemma_id is None:
+                lemma_id = self._add_lemma(get_doc_string(doc, lemma_hash), lemma_hash)
+            key = (lemma_id, chapter_id)
+            self._pending[key] = self._pending.get(key, 0) + count
+
+    def _add_entries(self, rows: np.ndarray, cols: np.ndarray, counts: np.ndarray):
+        """
+        Add matrix entries, summing entries for the same lemma and chapter.
+        """
+        rows = np.concatenate([self._rows, rows.astype(np.int32)])
+        cols = np.concatenate([self._cols, cols.astype(np.int32)])
+        counts = np.concatenate([self._counts, counts.astype(np.int32)])
+        keys = rows.astype(np.int64) * max(len(self.chapters), 1) + cols
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        self._counts = np.bincount(inverse, weights=counts, minlength=len(unique_keys)).astype(np.int32)
+        self._rows = (unique_keys // max(len(self.chapters), 1)).astype(np.int32)
+        self._cols = (unique_keys % max(len(self.chapters), 1)).astype(np.int32)
+
+    def _flush(self):
+        if len(self._pending) == 0:
+            return
+        entries = np.array([(x[0], x[1], y) for x, y in self._pending.items()], dtype=np.int64)
+        self._pending = {}
+        self._add_entries(entries[:, 0], entries[:, 1], entries[:, 2])
+
+    def get_entries(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: lemma ids, chapter ids and hits of every lemma and chapter with hits, ordered by lemma then chapter
+        """
+        self._flush()
+        return self._rows, self._cols, self._counts
+
+    def merge(self, other: "ChapterCountMatrix", book: Optional[int] = None):
+        """
+        Add the counts of another matrix to this one.
+        :param other: the matrix to add
+        :param book: if set, chapters of the other matrix are moved to this book number
+        """
+        rows, cols, counts = other.get_entries()
+        lemma_map = np.array([self._add_lemma(x, y) for x, y in zip(other.lemmas, other.lemma_hashes)],
+                             dtype=np.int32)
+        chapter_map = np.array([self._add_chapter(x[0] if book is None else book, x[1]) for x in other.chapters],
+                               dtype=np.int32)
+        if len(counts) == 0:
+            return
+        self._flush()
+        self._add_entries(lemma_map[rows], chapter_map[cols], counts)
+
+    def subtract(self, other: "ChapterCountMatrix", book: Optional[int] = None):
+        """
+        Take away the counts of another matrix. Entries left with no hits are dropped, lemmas and chapters are kept.
+        :param other: the matrix to take away
+        :param book: if set, chapters of the other matrix are taken from this book number
+        """
+        rows, cols, counts = other.get_entries()
+        lemma_ids = self._get_lemma_ids()
+        lemma_map = np.array([lemma_ids.get(x, -1) for x in other.lemma_hashes], dtype=np.int32)
+        chapter_map = np.array([self._chapter_ids.get((x[0] if book is None else book, x[1]), -1)
+                                for x in other.chapters], dtype=np.int32)
+        if len(counts) == 0:
+            return
+        rows, cols = lemma_map[rows], chapter_map[cols]
+        found = (rows >= 0) & (cols >= 0)
+        self._flush()
+        self._add_entries(rows[found], cols[found], -counts[found])
+        kept = self._counts > 0
+        self._rows, self._cols, self._counts = self._rows[kept], self._cols[kept], self._counts[kept]
+
+    def get_dense(self) -> np.ndarray:
+        """
+        :return: hits as a dense chapter x lemma array
+        """
+        rows, cols, counts = self.get_entries()
+        dense = np.zeros((len(self.chapters), len(self.lemmas)), dtype=np.int32)
+        dense[cols, rows] = counts
+        return dense
+
+    def get_frequencies(self) -> np.ndarray:
+        """
+        :return: total hits of each lemma, by lemma id
+        """
+        rows, _, counts = self.get_entries()
+        return np.bincount(rows, weights=counts, minlength=len(self.lemmas)).astype(np.int64)
+
+    def get_dispersion(self) -> np.ndarray:
+        """
+        :return: number of chapters each lemma appears in, by lemma id
+        """
+        rows, _, _ = self.get_entries()
+        return np.bincount(rows, minlength=len(self.lemmas))
+
+    def get_burstiness(self) -> np.ndarray:
+        """
+        Variance over mean of the hits per chapter of each lemma, by lemma id.
+        About 1 for words spread evenly through the text, much more for words that come in bursts.
+        """
+        rows, _, counts = self.get_entries()
+        num_chapters = max(len(self.chapters), 1)
+        mean = np.bincount(rows, weights=counts, minlength=len(self.lemmas)) / num_chapters
+        mean_of_squares = np.bincount(rows, weights=counts.astype(np.float64) ** 2,
+                                      minlength=len(self.lemmas)) / num_chapters
+        variance = mean_of_squares - mean ** 2
+        return np.divide(variance, mean, out=np.zeros_like(mean), where=mean > 0)
+
+    def get_book_totals(self) -> np.ndarray:
+        """
+        :return: hits as a dense lemma x book array. Column 0 is book 1.
+        """
+        rows, cols, counts = self.get_entries()
+        num_books = max((x[0] for x in self.chapters), default=0)
+        chapter_books = np.array([x[0] for x in self.chapters], dtype=np.int32).reshape(-1)
+        totals = np.zeros((len(self.lemmas), num_books), dtype=np.int64)
+        np.add.at(totals, (rows, chapter_books[cols] - 1), counts)
+        return totals
+
+    @staticmethod
+    def load(language: str) -> Optional["ChapterCountMatrix"]:
+        return PicklingBaseClass.s_load_if_exists(language, ChapterCountMatrix)
+
+
+def get_chapter_count_matrix(language: str, batch_size: int = 4, n_process: int = 1) -> ChapterCountMatrix:
+    """
+    Load the cached matrix, or build it from the book shards when the books changed.
+    Only books without a shard are counted.
+    """
+    books = get_books(language)
+    matrix = ChapterCountMatrix.load(language)
+    if (matrix is not None) and (matrix.book_hashes == [get_book_hash(x) for x in books]):
+        return matrix
+    print("building chapter count matrix from book shards")
+    return ingest(language, [ChapterCountMatrix], books, batch_size, n_process)[ChapterCountMatrix]
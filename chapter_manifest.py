@@ -0,0 +1,98 @@
+import json
+import os
+import sqlite3
+from typing import Iterator, List, Optional
+
+from epub_stream import ChapterRecord, iter_book_chapters, chapter_text
+from util import get_book_hash, get_text_hash
+
+
+class ChapterManifest:
+    """
+    Index of the text chapters of every book, stored in cache/<language>/chapter_manifest.sqlite.
+    Each book is read from its epub once. After that, any chapter of any book can be fetched directly.
+    Books are keyed by their content hash, so renaming or renumbering books doesn't reindex them.
+    The books table also keeps the path and book number the book was last read with.
+    """
+    def __init__(self, language: str):
+        self.language = language
+        db_path = ChapterManifest.get_db_path(language)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS books (
+            book_hash TEXT PRIMARY KEY,
+            book INTEGER,
+            path TEXT,
+            num_chapters INTEGER)""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS chapters (
+            book_hash TEXT,
+            chapter INTEGER,
+            item_name TEXT,
+            body_length INTEGER,
+            content_hash TEXT,
+            paragraphs TEXT,
+            PRIMARY KEY (book_hash, chapter))""")
+        self.connection.commit()
+
+    @staticmethod
+    def get_db_path(language: str) -> str:
+        return f"./cache/{language}/chapter_manifest.sqlite"
+
+    def index_book(self, input_path: str, book: int, book_hash: Optional[str] = None) -> str:
+        """
+        Read a book into the manifest unless it is already there.
+        :return: the book hash
+        """
+        if book_hash is None:
+            book_hash = get_book_hash(input_path)
+        row = self.connection.execute("SELECT book, path FROM books WHERE book_hash = ?", (book_hash,)).fetchone()
+        if row is not None:
+            if (row[0] != book) or (row[1] != input_path):
+                self.connection.execute("UPDATE books SET book = ?, path = ? WHERE book_hash = ?",
+                                        (book, input_path, book_hash))
+                self.connection.commit()
+            return book_hash
+
+        print("index book", book, input_path)
+        num_chapters = 0
+        with self.connection:
+            for chapter in iter_book_chapters(input_path, book):
+                num_chapters += 1
+                self.connection.execute("INSERT OR REPLACE INTO chapters VALUES (?, ?, ?, ?, ?, ?)",
+                                        (book_hash, chapter.chapter, chapter.item_name, chapter.body_length,
+                                         get_text_hash(chapter_text(chapter)), json.dumps(chapter.paragraphs)))
+            self.connection.execute("INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?)",
+                                    (book_hash, book, input_path, num_chapters))
+        return book_hash
+
+    def get_num_chapters(self, input_path: str, book: int) -> int:
+        book_hash = self.index_book(input_path, book)
+        return self.connection.execute("SELECT num_chapters FROM books WHERE book_hash = ?",
+                                       (book_hash,)).fetchone()[0]
+
+    def get_chapters(self, input_path: str, book: int, start_chapter: int = 1,
+                     num_chapters: Optional[int] = None) -> List[ChapterRecord]:
+        """
+        :param input_path: path to the epub
+        :param book: book number to put in the records
+        :param start_chapter: starting at 1, the first chapter to return
+        :param num_chapters: the number of chapters to return, None for the rest of the book
+        """
+        return list(self.iter_chapters(input_path, book, start_chapter, num_chapters))
+
+    def iter_chapters(self, input_path: str, book: int, start_chapter: int = 1,
+                      num_chapters: Optional[int] = None) -> Iterator[ChapterRecord]:
+        book_hash = self.index_book(input_path, book)
+        end_chapter = start_chapter + num_chapters if num_chapters is not None else 1 << 31
+        rows = self.connection.execute("""SELECT chapter, item_name, body_length, paragraphs FROM chapters
+            WHERE book_hash = ? AND chapter >= ? AND chapter < ? ORDER BY chapter""",
+                                       (book_hash, start_chapter, end_chapter))
+        for chapter, item_name, body_length, paragraphs in rows:
+            yield ChapterRecord(book=book, chapter=chapter, item_name=item_name, body_length=body_length,
+                                paragraphs=json.loads(paragraphs))
+
+    def get_content_hash(self, input_path: str, book: int, chapter: int) -> Optional[str]:
+        book_hash = self.index_book(input_path, book)
+        row = self.connection.execute("SELECT content_hash FROM chapters WHERE book_hash = ? AND chapter = ?",
+                                      (book_hash, chapter)).fetchone()
+        return row[0] if row is not None else None
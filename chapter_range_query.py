@@ -0,0 +1,79 @@
+from bisect import bisect_left, bisect_right
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from chapter_count_matrix import ChapterCountMatrix
+from deluxe_token_counter import DeluxeTokenCounter
+from previously_imported_words import PreviouslyImportedWords
+
+
+class ChapterRangeQuery:
+    """
+    The most common lemmas in any run of chapters, for example the next 5 chapters to read.
+    Keeps the cumulative hits of every lemma up to each chapter, so the hits in a run of chapters are one
+    subtraction of two rows, and the top lemmas are picked with argpartition instead of a full sort.
+    """
+    def __init__(self, matrix: ChapterCountMatrix, known_words: Optional[PreviouslyImportedWords] = None,
+                 word_count: Optional[DeluxeTokenCounter] = None):
+        """
+        :param matrix: the chapter counts
+        :param known_words: if set, lemmas already imported are left out
+        :param word_count: if set with known_words, lemmas are also left out when any of their forms was imported
+        """
+        self.lemmas = matrix.lemmas
+        # chapter ids are in counting order, rows of _cumulative are in reading order
+        order = sorted(range(len(matrix.chapters)), key=lambda x: matrix.chapters[x])
+        self.chapters: List[Tuple[int, int]] = [matrix.chapters[x] for x in order]
+        dense = matrix.get_dense()[order]
+        self._cumulative = np.zeros((len(self.chapters) + 1, len(self.lemmas)), dtype=np.int32)
+        np.cumsum(dense, axis=0, out=self._cumulative[1:])
+
+        self._known_words = known_words
+        self._word_count = word_count
+        self._known = np.zeros(len(self.lemmas), dtype=bool)
+        if known_words is not None:
+            # lemmas are lower case, so this is a join on string ids
+            self._known = np.isin(matrix.get_lemma_hashes(), known_words.get_seen_word_or_lemma_ids())
+
+    def get_range_counts(self, start_book: int, start_chapter: int, end_book: int, end_chapter: int) -> np.ndarray:
+        """
+        Hits of every lemma, by lemma id, from chapter start_chapter of book start_book to chapter end_chapter of
+        book end_book, both included. Chapters and books start at 1.
+        """
+        start = bisect_left(self.chapters, (start_book, start_chapter))
+        stop = bisect_right(self.chapters, (end_book, end_chapter))
+        if stop <= start:
+            return np.zeros(len(self.lemmas), dtype=np.int32)
+        return self._cumulative[stop] - self._cumulative[start]
+
+    def _is_known(self, lemma_id: int) -> bool:
+        if self._known[lemma_id]:
+            return True
+        if (self._known_words is None) or (self._word_count is None):
+            return False
+        return self._known_words.has_seen_ids(self._word_count.get_string_ids(self.lemmas[lemma_id]))
+
+    def get_top_lemmas(self, start_book: int, start_chapter: int, end_book: int, end_chapter: int,
+                       number_of_words: int, include_known: bool = False) -> List[Tuple[str, int]]:
+        """
+        :return: (lemma, hits) of the most common lemmas in a run of chapters, see get_range_counts.
+        Ties go to the lemma seen first.
+        """
+        counts = self.get_range_counts(start_book, start_chapter, end_book, end_chapter)
+        if not include_known:
+            counts = np.where(self._known, 0, counts)
+        num_candidates = int(np.count_nonzero(counts))
+        k = min(number_of_words, num_candidates)
+        # most hits first, then lowest lemma id. Unique scores keep ties in order at the edge of the partition too
+        num_lemmas = len(self.lemmas)
+        scores = counts.astype(np.int64) * num_lemmas + (num_lemmas - 1 - np.arange(num_lemmas))
+        while k > 0:
+            top_ids = np.argpartition(-scores, k - 1)[:k]
+            top_ids = top_ids[np.argsort(-scores[top_ids])]
+            output = [(self.lemmas[x], int(counts[x])) for x in top_ids if include_known or not self._is_known(x)]
+            if (len(output) >= number_of_words) or (k == num_candidates):
+                return output[:number_of_words]
+            # some lemmas were known by another form, look further down
+            k = min(k * 2, num_candidates)
+        return []
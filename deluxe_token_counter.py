@@ -1,16 +1,21 @@
 import os
 import pickle
-from typing import TypedDict, Dict, List, Optional
+from array import array
+from typing import TypedDict, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
 
-import ebooklib
-import spacy
-from ebooklib import epub
-
-from spacy.tokens import Token
+import numpy as np
 
 from all_names import harry_potter_name_map
+from frequency_ranking import FrequencyRanking, RankKey
+from ingestion import register_counter, count_book, get_first_occurrences, get_doc_string, get_sentence_starts, \
+    DOC_LEMMA, DOC_LOWER, DOC_POS, DOC_IS_ALPHA, DOC_IS_STOP, DOC_ORTH, DOC_LOWER_LEMMA
 from pickling_base import PicklingBaseClass
-from util import get_books, language_to_code, is_text_chapter, chapter_to_str
+from string_ids import StringTable, get_string_id
+from util import get_books, get_book_hash
+
+if TYPE_CHECKING:
+    # only for type hints, so loading a cached counter doesn't import spacy
+    from spacy.tokens import Doc, Token
 
 
 class FirstLemmaHit(TypedDict):
@@ -28,100 +33,474 @@ class DeluxeLemmaHit(TypedDict):
     first_hit_by_part_of_speech: Dict[str, FirstLemmaHit]
 
 
+class LemmaRecord:
+    """
+    Counts of one lemma. First hits are row numbers in the hit table of the counter that owns the record.
+    texts are keyed on the string id of the lower case text.
+    """
+    __slots__ = ('lemma', 'hits', 'first_hit', 'texts', 'first_hit_by_part_of_speech')
+
+    def __init__(self, lemma: str, hits: int, first_hit: int, texts: Dict[int, int],
+                 first_hit_by_part_of_speech: Dict[str, int]):
+        self.lemma = lemma
+        self.hits = hits
+        self.first_hit = first_hit
+        self.texts = texts
+        self.first_hit_by_part_of_speech = first_hit_by_part_of_speech
+
+    def __reduce__(self):
+        # a plain tuple pickles much smaller than the slot state dict
+        return LemmaRecord, (self.lemma, self.hits, self.first_hit, self.texts, self.first_hit_by_part_of_speech)
+
+    def get_first_hits(self) -> List[int]:
+        return [self.first_hit] + list(self.texts.values()) + list(self.first_hit_by_part_of_speech.values())
+
+
+@register_counter
 class DeluxeTokenCounter(PicklingBaseClass):
     """
     This is the final version of a token counter, intended to count tokens across all books in a set.
     This version remembers where it first saw a word and also knows about lemmas provided by spacy.
     Note that spacy lemmas are much less sophisticated than wiktionary lemmas.
+    First hits are rows of a hit table (text, sentence, book, chapter, position) and every sentence is stored
+    once, in the sentence table. get_hit_info turns them back into DeluxeLemmaHit dicts.
+    First hits are the earliest by (book, chapter, position of the token in the chapter), so counters of any
+    parts of the text can be merged in any order.
+    Lemmas are ranked by hits, ties going to the lemma seen first. The ranking is updated as lemmas are counted
+    and saved with the counter.
+    Lemmas and texts are keyed on the string ids of their lower case text (see string_ids) and only turned
+    back into text for output.
     """
+    # the sentence table compresses well: less than half the size, loading as fast (see benchmark_serializers.py)
+    serializer = 'pickle+zstd'
+
     def __init__(self, language: str):
-        self._hits_by_lemma: Dict[str, DeluxeLemmaHit] = {}
-        self._lemmas_by_frequency: List[str] = []
+        self._hits_by_lemma: Dict[int, LemmaRecord] = {}
+        # lower case lemmas and texts by string id
+        self._strings = StringTable()
+        self._ranking = FrequencyRanking()
+        # content hashes of the books this counter was built from, in book order
+        self.book_hashes: List[str] = []
+        self._init_hit_table()
         super().__init__(language)
 
+    def _init_hit_table(self):
+        self._hit_texts: List[str] = []
+        self._hit_sentences = array('i')  # index into _sentences
+        self._hit_books = array('H')
+        self._hit_chapters = array('H')
+        self._hit_positions = array('I')  # index of the token in its chapter
+        self._sentences: List[str] = []
+        # sentence text to index in _sentences. Not pickled, built when something is added
+        self._sentence_ids: Optional[Dict[str, int]] = {}
+
     def __getstate__(self):
+        # save the ranking sorted, so loading never sorts
+        self._ranking.refresh(self._get_rank_key)
         state = self.__dict__.copy()
-        # Don't pickle baz
-        del state["_lemmas_by_frequency"]
+        del state["_sentence_ids"]
+        # records in rank order, the ranking has their keys
+        state["_hits_by_lemma"] = [self._hits_by_lemma[x] for x in self._ranking.range(0, len(self._ranking))]
         return state
 
     def __setstate__(self, state):
-        self.__dict__.update(state)
-        # Add baz back since it doesn't exist in the pickle
-        self._lemmas_by_frequency = []
+        self.book_hashes = []  # older caches don't know which books they came from
+        if "_sentences" not in state:
+            # older caches keep a FirstLemmaHit dict with the whole sentence for every first hit
+            hits_by_lemma = state.pop("_hits_by_lemma")
+            self.__dict__.update(state)
+            self._init_hit_table()
+            self._hits_by_lemma = {}
+            self._add_lemma_hits(hits_by_lemma)
+        else:
+            self.__dict__.update(state)
+            self._sentence_ids = None
+        if "_hit_positions" not in state:
+            # older caches add hits in reading order, so the row number orders hits within a chapter
+            self._hit_positions = array('I', range(len(self._hit_texts)))
+        if "_strings" not in state:
+            # older caches key on text and may not have a ranking
+            self._use_string_ids()
+        else:
+            self._hits_by_lemma = dict(zip(self._ranking.range(0, len(self._ranking)), self._hits_by_lemma))
+
+    def _use_string_ids(self):
+        self._strings = StringTable()
+        hits_by_lemma = self._hits_by_lemma
+        self._hits_by_lemma = {}
+        for key, record in hits_by_lemma.items():
+            record.texts = {self._strings.add(k): v for k, v in record.texts.items()}
+            self._hits_by_lemma[self._strings.add(key)] = record
+        self._ranking = FrequencyRanking()
+        self._ranking.touch_all(self._hits_by_lemma.keys())
+
+    def _add_lemma_hits(self, hits_by_lemma: Dict[str, DeluxeLemmaHit]):
+        rows = {}  # the same first hit is shared by first_hit_info, texts and first_hit_by_part_of_speech
 
-    def get_hit_info(self, lemma) -> Optional[DeluxeLemmaHit]:
-        return self._hits_by_lemma.get(lemma, None)
+        def add_hit(hit_info: FirstLemmaHit) -> int:
+            if id(hit_info) not in rows:
+                rows[id(hit_info)] = self._add_hit(hit_info['text'], self._intern_sentence(hit_info['sent']),
+                                                   hit_info['book'], hit_info['chapter'], len(self._hit_texts))
+            return rows[id(hit_info)]
+
+        for key, lemma_hit in hits_by_lemma.items():
+            self._hits_by_lemma[key] = LemmaRecord(
+                lemma_hit['lemma'], lemma_hit['hits'], add_hit(lemma_hit['first_hit_info']),
+                {k: add_hit(v) for k, v in lemma_hit['texts'].items()},
+                {k: add_hit(v) for k, v in lemma_hit['first_hit_by_part_of_speech'].items()})
+
+    def _intern_sentence(self, sentence: str) -> int:
+        if self._sentence_ids is None:
+            self._sentence_ids = {x: i for i, x in enumerate(self._sentences)}
+        sentence_id = self._sentence_ids.get(sentence, None)
+        if sentence_id is None:
+            sentence_id = len(self._sentences)
+            self._sentences.append(sentence)
+            self._sentence_ids[sentence] = sentence_id
+        return sentence_id
+
+    def _add_hit(self, text: str, sentence_id: int, book: int, chapter: int, position: int) -> int:
+        self._hit_texts.append(text)
+        self._hit_sentences.append(sentence_id)
+        self._hit_books.append(book)
+        self._hit_chapters.append(chapter)
+        self._hit_positions.append(position)
+        return len(self._hit_texts) - 1
+
+    def _get_hit_order(self, hit: int) -> Tuple[int, int, int]:
+        return self._hit_books[hit], self._hit_chapters[hit], self._hit_positions[hit]
+
+    def _get_first_hit_info(self, hit: int) -> FirstLemmaHit:
+        return FirstLemmaHit(text=self._hit_texts[hit], sent=self._sentences[self._hit_sentences[hit]],
+                             book=self._hit_books[hit], chapter=self._hit_chapters[hit])
+
+    def get_hit_info(self, lemma: str) -> Optional[DeluxeLemmaHit]:
+        """
+        :param lemma: a lower case lemma
+        """
+        record = self._hits_by_lemma.get(get_string_id(lemma), None)
+        if record is None:
+            return None
+        hit_infos = {}  # share first hits like the counter does
+
+        def get_info(hit: int) -> FirstLemmaHit:
+            if hit not in hit_infos:
+                hit_infos[hit] = self._get_first_hit_info(hit)
+            return hit_infos[hit]
+
+        return DeluxeLemmaHit(hits=record.hits, first_hit_info=get_info(record.first_hit), lemma=record.lemma,
+                              texts={self._strings.get_text(k): get_info(v) for k, v in record.texts.items()},
+                              first_hit_by_part_of_speech={k: get_info(v) for k, v in
+                                                           record.first_hit_by_part_of_speech.items()})
+
+    def get_string_ids(self, lemma: str) -> List[int]:
+        """
+        :param lemma: a lower case lemma
+        :return: string ids of the lemma and every lower case text it was seen as, or [] if it was never counted
+        """
+        key = get_string_id(lemma)
+        record = self._hits_by_lemma.get(key, None)
+        if record is None:
+            return []
+        return [key] + list(record.texts.keys())
+
+    def _get_rank_key(self, key: int) -> Optional[RankKey]:
+        record = self._hits_by_lemma.get(key, None)
+        if record is None:
+            return None
+        return (-record.hits,) + self._get_hit_order(record.first_hit) + (key,)
+
+    def get_ranking(self) -> FrequencyRanking:
+        self._ranking.refresh(self._get_rank_key)
+        return self._ranking
+
+    def get_top_lemmas(self, k: int) -> List[str]:
+        return self._strings.get_texts(self.get_ranking().top(k))
+
+    def get_lemmas_in_rank_range(self, start: int, stop: int) -> List[str]:
+        """
+        :param start: starting at 0, the first rank to return
+        :param stop: the rank after the last rank to return
+        """
+        return self._strings.get_texts(self.get_ranking().range(start, stop))
+
+    def get_rank(self, lemma: str) -> Optional[int]:
+        """
+        :return: starting at 0, the rank of a lemma, or None if it was never counted
+        """
+        return self.get_ranking().rank_of(get_string_id(lemma))
 
     def get_lemmas_by_frequency(self) -> List[str]:
-        if len(self._lemmas_by_frequency) == 0:
-            self._lemmas_by_frequency = list(self._hits_by_lemma.keys())
-            lemma_map = self._hits_by_lemma
-            self._lemmas_by_frequency = sorted(self._lemmas_by_frequency, key=lambda x: lemma_map[x]['hits'],
-                                               reverse=True)
-        return self._lemmas_by_frequency
-
-    def add(self, token: Token, book: int, chapter: int):
+        ranking = self.get_ranking()
+        return self._strings.get_texts(ranking.range(0, len(ranking)))
+
+    def _add_hits(self, key: int, lemma: str, text_key: int, text: str, part_of_speech: str,
+                  get_sentence_id: Callable[[], int], book: int, chapter: int, position: int, hits: int):
+        """
+        Count hits of a lemma. Tokens of a chapter must be added in order.
+        :param key: string id of the lower case lemma
+        :param text_key: string id of the lower case text
+        """
+        self._ranking.touch(key)
+        record = self._hits_by_lemma.get(key, None)
+        if record is None:
+            self._strings.add(lemma.lower(), key)
+            self._strings.add(text.lower(), text_key)
+            hit = self._add_hit(text, get_sentence_id(), book, chapter, position)
+            self._hits_by_lemma[key] = LemmaRecord(lemma, hits, hit, {text_key: hit}, {part_of_speech: hit})
+            return
+        record.hits += hits
+        new_text = text_key not in record.texts
+        new_part_of_speech = part_of_speech not in record.first_hit_by_part_of_speech
+        if new_text or new_part_of_speech:
+            # only first hits need the sentence
+            hit = self._add_hit(text, get_sentence_id(), book, chapter, position)
+            if new_text:
+                self._strings.add(text.lower(), text_key)
+                record.texts[text_key] = hit
+            if new_part_of_speech:
+                record.first_hit_by_part_of_speech[part_of_speech] = hit
+
+    def add(self, token: 'Token', book: int, chapter: int):
         if (not token.is_alpha) or token.is_stop:
             return
-        key = token.lemma_.lower()
-        text_key = token.text.lower()
-        part_of_speech = token.pos_
-        first_hit_info = FirstLemmaHit(text=token.text, sent=token.sent.text, book=book, chapter=chapter)
-        if key not in self._hits_by_lemma:
-            self._hits_by_lemma[key] = DeluxeLemmaHit(hits=1, first_hit_info=first_hit_info,
-                                                      lemma=token.lemma_,
-                                                      texts={text_key: first_hit_info},
-                                                      first_hit_by_part_of_speech={part_of_speech: first_hit_info})
-        else:
-            lemma_hit = self._hits_by_lemma[key]
-            lemma_hit['hits'] += 1
-            if text_key not in lemma_hit['texts']:
-                lemma_hit['texts'][text_key] = first_hit_info
-            if part_of_speech not in lemma_hit['first_hit_by_part_of_speech']:
-                lemma_hit['first_hit_by_part_of_speech'][part_of_speech] = first_hit_info
+        self._add_hits(get_string_id(token.lemma_.lower()), token.lemma_, get_string_id(token.text.lower()),
+                       token.text, token.pos_, lambda: self._intern_sentence(token.sent.text), book, chapter, token.i,
+                       1)
+
+    def add_doc(self, doc: 'Doc', doc_array: np.ndarray, book: int, chapter: int):
+        """
+        Same as add for every token of a doc. Hits are counted with numpy, and only tokens that are the first
+        of their lemma with their text or part of speech in this doc are looked at one by one.
+        """
+        indexes = np.flatnonzero((doc_array[:, DOC_IS_ALPHA] == 1) & (doc_array[:, DOC_IS_STOP] == 0))
+        if len(indexes) == 0:
+            return
+        _, text_firsts, _ = get_first_occurrences(doc_array[indexes][:, [DOC_LOWER_LEMMA, DOC_LOWER]])
+        _, part_of_speech_firsts, _ = get_first_occurrences(doc_array[indexes][:, [DOC_LOWER_LEMMA, DOC_POS]])
+        sentence_starts = get_sentence_starts(doc_array)
+        sentence_ids = {}
+
+        def get_sentence_id(i_token: int) -> int:
+            i_sentence = int(np.searchsorted(sentence_starts, i_token, 'right')) - 1
+            if i_sentence not in sentence_ids:
+                end = sentence_starts[i_sentence + 1] if i_sentence + 1 < len(sentence_starts) else len(doc)
+                sentence_ids[i_sentence] = self._intern_sentence(doc[sentence_starts[i_sentence]:end].text)
+            return sentence_ids[i_sentence]
+
+        # the columns are string ids, so candidates are added without making tokens
+        candidates = indexes[np.union1d(text_firsts, part_of_speech_firsts)]
+        for i_token, row in zip(candidates.tolist(), doc_array[candidates].tolist()):
+            self._add_hits(row[DOC_LOWER_LEMMA], get_doc_string(doc, row[DOC_LEMMA]), row[DOC_LOWER],
+                           get_doc_string(doc, row[DOC_ORTH]), get_doc_string(doc, row[DOC_POS]),
+                           lambda: get_sentence_id(i_token), book, chapter, i_token, 0)
+
+        keys, _, counts = get_first_occurrences(doc_array[indexes, DOC_LOWER_LEMMA])
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self._hits_by_lemma[key].hits += count
+
+    def add_token(self, token: 'Token', book: int, chapter: int):
+        self.add(token, book, chapter)
+
+    def _hit_copier(self, other: "DeluxeTokenCounter", book: Optional[int]) -> Callable[[int], int]:
+        """
+        :return: a function that copies a row of the hit table of other into this counter and returns the new row.
+        Each row and sentence is only copied once.
+        """
+        rows = {}
+        sentence_ids = {}
+
+        def copy_hit(hit: int) -> int:
+            if hit not in rows:
+                other_sentence_id = other._hit_sentences[hit]
+                if other_sentence_id not in sentence_ids:
+                    sentence_ids[other_sentence_id] = self._intern_sentence(other._sentences[other_sentence_id])
+                rows[hit] = self._add_hit(other._hit_texts[hit], sentence_ids[other_sentence_id],
+                                          other._hit_books[hit] if book is None else book, other._hit_chapters[hit],
+                                          other._hit_positions[hit])
+            return rows[hit]
+        return copy_hit
+
+    def _merge_record(self, key: int, other: "DeluxeTokenCounter", other_record: LemmaRecord,
+                      copy_hit: Callable[[int], int], book: Optional[int]):
+        """
+        Add a record of another counter. Each first hit is the earlier of the two.
+        """
+        def is_earlier(other_hit: int, hit: int) -> bool:
+            other_book = other._hit_books[other_hit] if book is None else book
+            return ((other_book, other._hit_chapters[other_hit], other._hit_positions[other_hit]) <
+                    self._get_hit_order(hit))
+
+        self._ranking.touch(key)
+        record = self._hits_by_lemma.get(key, None)
+        if record is None:
+            self._hits_by_lemma[key] = LemmaRecord(
+                other_record.lemma, other_record.hits, copy_hit(other_record.first_hit),
+                {k: copy_hit(v) for k, v in other_record.texts.items()},
+                {k: copy_hit(v) for k, v in other_record.first_hit_by_part_of_speech.items()})
+            return
+        record.hits += other_record.hits
+        if is_earlier(other_record.first_hit, record.first_hit):
+            record.lemma = other_record.lemma
+            record.first_hit = copy_hit(other_record.first_hit)
+        for text_key, hit in other_record.texts.items():
+            if (text_key not in record.texts) or is_earlier(hit, record.texts[text_key]):
+                record.texts[text_key] = copy_hit(hit)
+        for part_of_speech, hit in other_record.first_hit_by_part_of_speech.items():
+            if ((part_of_speech not in record.first_hit_by_part_of_speech) or
+                    is_earlier(hit, record.first_hit_by_part_of_speech[part_of_speech])):
+                record.first_hit_by_part_of_speech[part_of_speech] = copy_hit(hit)
+
+    def merge(self, other: "DeluxeTokenCounter", book: Optional[int] = None):
+        """
+        Add the counts of another counter to this one.
+        Counters of any parts of the text can be merged in any order, the earliest first hits win.
+        :param other: the counter to add
+        :param book: if set, first hits copied from the other counter are moved to this book number.
+        Book shards are counted as book 1 and moved to their place in the series when merged.
+        """
+        copy_hit = self._hit_copier(other, book)
+        self._strings.update(other._strings)
+        for key, other_record in other._hits_by_lemma.items():
+            self._merge_record(key, other, other_record, copy_hit, book)
+
+    def subtract(self, other: "DeluxeTokenCounter", book: int) -> List[int]:
+        """
+        Remove the counts of one book, given the counter of that book.
+        Lemmas that are left with no hits are removed.
+        :param other: the counter of the book to remove
+        :param book: the book number of that book in this counter
+        :return: string ids of lemmas that still have hits but had first hits in the removed book.
+        Call refill_first_hits for these.
+        """
+        stale_keys = []
+        for key, other_record in other._hits_by_lemma.items():
+            record = self._hits_by_lemma.get(key, None)
+            if record is None:
+                continue
+            record.hits -= other_record.hits
+            self._ranking.touch(key)
+            if record.hits <= 0:
+                del self._hits_by_lemma[key]
+            elif any(self._hit_books[x] == book for x in record.get_first_hits()):
+                stale_keys.append(key)
+        return stale_keys
+
+    def refill_first_hits(self, keys: List[int], book_counters: List[Tuple[int, "DeluxeTokenCounter"]]):
+        """
+        Rebuild the first hits of some lemmas from per-book counters. Hit counts are kept as they are.
+        :param keys: string ids of the lemmas to rebuild
+        :param book_counters: (book number, counter for that book) for every book, in any order
+        """
+        hits_by_key = {key: self._hits_by_lemma.pop(key).hits for key in keys}
+        for book, book_counter in book_counters:
+            copy_hit = self._hit_copier(book_counter, book)
+            for key in keys:
+                if key in book_counter._hits_by_lemma:
+                    self._merge_record(key, book_counter, book_counter._hits_by_lemma[key], copy_hit, book)
+        for key, hits in hits_by_key.items():
+            self._hits_by_lemma[key].hits = hits
+
+    def remove_book_number(self, book: int):
+        """
+        Book numbers after a removed book move down by one.
+        """
+        for hit, hit_book in enumerate(self._hit_books):
+            if hit_book > book:
+                self._hit_books[hit] = hit_book - 1
+        # rank keys include the book number
+        self._ranking.touch_all(self._hits_by_lemma.keys())
+
+    def compact(self):
+        """
+        Drop hits and sentences nothing points to any more, after subtract and refill_first_hits.
+        """
+        old = DeluxeTokenCounter(self.language)
+        old._hit_texts, old._hit_sentences, old._hit_books, old._hit_chapters, old._hit_positions, old._sentences = (
+            self._hit_texts, self._hit_sentences, self._hit_books, self._hit_chapters, self._hit_positions,
+            self._sentences)
+        self._init_hit_table()
+        copy_hit = self._hit_copier(old, None)
+        # copy the rows in their old order
+        for hit in sorted({x for record in self._hits_by_lemma.values() for x in record.get_first_hits()}):
+            copy_hit(hit)
+        for record in self._hits_by_lemma.values():
+            record.first_hit = copy_hit(record.first_hit)
+            record.texts = {k: copy_hit(v) for k, v in record.texts.items()}
+            record.first_hit_by_part_of_speech = {k: copy_hit(v) for k, v in record.first_hit_by_part_of_speech.items()}
 
     @staticmethod
     def load(language: str) -> Optional["DeluxeTokenCounter"]:
         return PicklingBaseClass.s_load_if_exists(language, DeluxeTokenCounter)
 
 
-def get_deluxe_word_count(language: str) -> DeluxeTokenCounter:
+def get_book_shard(language: str, input_path: str, book_hash: str, batch_size: int = 4,
+                   n_process: int = 1) -> DeluxeTokenCounter:
+    """
+    Load the counter for a single book or count it the hard way.
+    The book is always counted as book 1. Merge it into a series counter with its real book number.
+    Shards are saved in cache/<language>/DeluxeTokenCounter/<book hash>.pickle
+    """
+    return count_book(language, input_path, book_hash, [DeluxeTokenCounter], batch_size, n_process)[0]
+
+
+def get_deluxe_word_count(language: str, batch_size: int = 4, n_process: int = 1) -> DeluxeTokenCounter:
+    """
+    Load the cached counter, updating it if books were added or removed.
+    Each book has its own shard, so a new book only counts that book and a removed book is subtracted
+    without counting anything.
+    :param language: the language
+    :param batch_size: number of chapters spacy parses together (nlp.pipe batch_size)
+    :param n_process: number of processes to count with. Each process counts a run of consecutive chapters
+    into its own partial counter and the partial counters are merged.
+    """
     books = get_books(language)
+    book_hashes = [get_book_hash(x) for x in books]
     counter = DeluxeTokenCounter.load(language)
-    if counter is not None:
+    if counter is not None and len(counter.book_hashes) == 0:
+        print("cache does not list its books, assuming it matches", books)
+        counter.book_hashes = book_hashes
+        counter.save()
+    if counter is not None and counter.book_hashes == book_hashes:
         return counter
-    print("no cache, counting the hard way")
-
-    nlp = spacy.load(language_to_code(language) + "_core_news_lg")
-
-    counter = DeluxeTokenCounter(language)
-
-    i_book = 0
-    for input_path in books:
-        i_book += 1
-        print("=" * 40, "read book", i_book, input_path)
-        book = epub.read_epub(input_path)
-        # items = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
-        all_items = book.get_items_of_type(ebooklib.ITEM_DOCUMENT)
-        chapter_num = 0
-
-        for item in all_items:
-            if is_text_chapter(item, language):
-                chapter_num += 1
-                print(f"chapter {chapter_num} length is {len(item.get_body_content())}")
-                text = chapter_to_str(item)
-                doc = nlp(text)
-                for sent in doc.sents:
-                    for token in sent:
-                        if token.is_alpha and not token.is_stop:
-                            counter.add(token, i_book, chapter_num)
-                print("counted chapter", chapter_num)
-            else:
-                print("skip chapter", item.get_name())
 
+    def load_shard(book_hash: str) -> DeluxeTokenCounter:
+        return get_book_shard(language, books[book_hashes.index(book_hash)], book_hash, batch_size, n_process)
+
+    kept_hashes = [x for x in counter.book_hashes if x in book_hashes] if counter is not None else []
+    if (counter is None) or (book_hashes[:len(kept_hashes)] != kept_hashes):
+        # first count, or books were inserted before books that are already counted: merge every shard
+        print("building word count from book shards")
+        counter = DeluxeTokenCounter(language)
+        for i_book, book_hash in enumerate(book_hashes):
+            counter.merge(load_shard(book_hash), i_book + 1)
+        counter.book_hashes = book_hashes
         counter.save()
+        return counter
+
+    # remove books that are gone, last book first so book numbers stay valid
+    for i_book in reversed(range(len(counter.book_hashes))):
+        book_hash = counter.book_hashes[i_book]
+        if book_hash in book_hashes:
+            continue
+        print("removing book", i_book + 1, "from word count")
+        shard = PicklingBaseClass.s_load_shard_if_exists(language, DeluxeTokenCounter, book_hash)
+        if shard is None:
+            raise Exception(f"no shard for removed book {i_book + 1}, delete the cache to recount")
+        stale_keys = counter.subtract(shard, i_book + 1)
+        del counter.book_hashes[i_book]
+        counter.remove_book_number(i_book + 1)
+        if len(stale_keys) > 0:
+            counter.refill_first_hits(stale_keys, [(i + 1, load_shard(x)) for i, x in enumerate(counter.book_hashes)])
+        counter.compact()
+
+    # add new books at the end of the series
+    for book_hash in book_hashes[len(counter.book_hashes):]:
+        print("adding book", len(counter.book_hashes) + 1, "to word count")
+        counter.merge(load_shard(book_hash), len(counter.book_hashes) + 1)
+        counter.book_hashes.append(book_hash)
 
+    counter.save()
     return counter
 
 
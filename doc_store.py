@@ -0,0 +1,76 @@
+import os
+from typing import Iterable, Iterator, List, Optional
+
+from spacy import Language as SpacyLanguage
+from spacy.tokens import Doc, DocBin
+
+from util import get_text_hash
+
+# enough to get tokens, lemmas, parts of speech, stop words and sentences back without running the pipeline
+DOC_ATTRS = ["ORTH", "NORM", "LEMMA", "POS", "TAG", "MORPH", "SENT_START"]
+
+
+class DocStore:
+    """
+    Parsed chapters saved on disk so each chapter only goes through spacy once.
+    Docs are stored as DocBin files in cache/<language>/docs/<pipeline>-<version>/<components>/ and are keyed by a
+    hash of the text, so any code that parses the same chapter text with the same components gets the same Doc back.
+    """
+    def __init__(self, language: str, nlp: SpacyLanguage):
+        self.language = language
+        self.nlp = nlp
+        meta = nlp.meta
+        self.root_path = os.path.join('cache', language, 'docs', f"{meta['lang']}_{meta['name']}-{meta['version']}",
+                                      '+'.join(nlp.pipe_names))
+
+    def get_doc_path(self, text: str) -> str:
+        text_hash = get_text_hash(text)
+        return os.path.join(self.root_path, text_hash[:2], text_hash + '.spacy')
+
+    def load_doc(self, text: str) -> Optional[Doc]:
+        doc_path = self.get_doc_path(text)
+        if not os.path.exists(doc_path):
+            return None
+        doc_bin = DocBin().from_disk(doc_path)
+        return list(doc_bin.get_docs(self.nlp.vocab))[0]
+
+    def save_doc(self, text: str, doc: Doc):
+        doc_path = self.get_doc_path(text)
+        os.makedirs(os.path.dirname(doc_path), exist_ok=True)
+        doc_bin = DocBin(attrs=DOC_ATTRS, store_user_data=False)
+        doc_bin.add(doc)
+        # write then rename, so other processes never read half a file
+        temp_path = f"{doc_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as file_out:
+            file_out.write(doc_bin.to_bytes())
+        os.replace(temp_path, doc_path)
+
+    def get_doc(self, text: str) -> Doc:
+        doc = self.load_doc(text)
+        if doc is None:
+            doc = self.nlp(text)
+            self.save_doc(text, doc)
+        return doc
+
+    def pipe(self, texts: Iterable[str], batch_size: int = 4) -> Iterator[Doc]:
+        """
+        Like nlp.pipe, but stored docs are loaded instead of parsed. Docs come back in the same order as texts.
+        """
+        batch: List[str] = []
+        for text in texts:
+            batch.append(text)
+            if len(batch) >= batch_size:
+                yield from self._pipe_batch(batch, batch_size)
+                batch = []
+        if len(batch) > 0:
+            yield from self._pipe_batch(batch, batch_size)
+
+    def _pipe_batch(self, texts: List[str], batch_size: int) -> List[Doc]:
+        docs = [self.load_doc(text) for text in texts]
+        missing = [i for i in range(0, len(texts)) if docs[i] is None]
+        if len(missing) > 0:
+            parsed = self.nlp.pipe([texts[i] for i in missing], batch_size=batch_size)
+            for i, doc in zip(missing, parsed):
+                self.save_doc(texts[i], doc)
+                docs[i] = doc
+        return docs
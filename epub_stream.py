@@ -0,0 +1,132 @@
+"""
+Read chapter text straight out of the epub zip file.
+Only the container, the package document and one chapter at a time are read, and paragraphs are pulled out
+with lxml's iterparse, so this stays fast and small even for very large omnibus epubs.
+"""
+import posixpath
+import zipfile
+from io import BytesIO
+from typing import Iterator, List, NamedTuple
+from urllib.parse import unquote
+
+from lxml import etree
+
+from util import MIN_TEXT_CHAPTER_LENGTH
+
+CONTAINER_PATH = 'META-INF/container.xml'
+CONTAINER_NS = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+OPF_NS = '{http://www.idpf.org/2007/opf}'
+XHTML_NS = '{http://www.w3.org/1999/xhtml}'
+DOCUMENT_MEDIA_TYPE = 'application/xhtml+xml'
+
+
+class ChapterRecord(NamedTuple):
+    book: int
+    chapter: int
+    item_name: str
+    body_length: int
+    paragraphs: List[str]
+
+
+class ParagraphRecord(NamedTuple):
+    book: int
+    chapter: int
+    paragraph_index: int
+    text: str
+
+
+def get_spine_document_paths(epub_zip: zipfile.ZipFile) -> List[str]:
+    """
+    :return: the zip paths of the xhtml documents in reading (spine) order
+    """
+    container = etree.fromstring(epub_zip.read(CONTAINER_PATH))
+    opf_path = container.find(f'.//{CONTAINER_NS}rootfile').get('full-path')
+    opf_dir = posixpath.dirname(opf_path)
+    package = etree.fromstring(epub_zip.read(opf_path))
+
+    href_by_id = {}
+    for item in package.iter(f'{OPF_NS}item'):
+        if item.get('media-type') == DOCUMENT_MEDIA_TYPE:
+            href_by_id[item.get('id')] = item.get('href')
+
+    paths = []
+    for itemref in package.iter(f'{OPF_NS}itemref'):
+        href = href_by_id.get(itemref.get('idref'), None)
+        if href is not None:
+            paths.append(posixpath.normpath(posixpath.join(opf_dir, unquote(href))))
+    return paths
+
+
+def get_body_length(data: bytes) -> int:
+    """
+    Length of the content of the body tag. This is what is_text_chapter measures with ebooklib.
+    """
+    start = data.find(b'<body')
+    if start < 0:
+        return len(data)
+    start = data.find(b'>', start) + 1
+    end = data.rfind(b'</body>')
+    if end < start:
+        end = len(data)
+    return end - start
+
+
+def get_paragraph_texts(data: bytes) -> List[str]:
+    """
+    The text of every <p> in an xhtml document. Falls back to the html parser for documents that aren't valid xml.
+    """
+    try:
+        return _get_paragraph_texts(data, html=False)
+    except etree.XMLSyntaxError:
+        return _get_paragraph_texts(data, html=True)
+
+
+def _get_paragraph_texts(data: bytes, html: bool) -> List[str]:
+    texts = []
+    tags = 'p' if html else (f'{XHTML_NS}p', 'p')
+    for _, element in etree.iterparse(BytesIO(data), events=('end',), tag=tags, html=html, remove_comments=True,
+                                      remove_pis=True):
+        texts.append(''.join(element.itertext()))
+        # drop what we have read so memory doesn't grow with the document
+        element.clear(keep_tail=True)
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    return texts
+
+
+def iter_book_chapters(input_path: str, book: int) -> Iterator[ChapterRecord]:
+    """
+    Lazily read the text chapters of a book. Chapters shorter than MIN_TEXT_CHAPTER_LENGTH are skipped.
+    :param input_path: path to the epub
+    :param book: book number to put in the records
+    """
+    with zipfile.ZipFile(input_path) as epub_zip:
+        chapter_num = 0
+        for item_name in get_spine_document_paths(epub_zip):
+            data = epub_zip.read(item_name)
+            body_length = get_body_length(data)
+            if body_length < MIN_TEXT_CHAPTER_LENGTH:
+                print("skip chapter", item_name)
+                continue
+            chapter_num += 1
+            yield ChapterRecord(book=book, chapter=chapter_num, item_name=item_name, body_length=body_length,
+                                paragraphs=get_paragraph_texts(data))
+
+
+def iter_book_paragraphs(input_path: str, book: int) -> Iterator[ParagraphRecord]:
+    for chapter in iter_book_chapters(input_path, book):
+        for paragraph_index, text in enumerate(chapter.paragraphs):
+            yield ParagraphRecord(book=chapter.book, chapter=chapter.chapter, paragraph_index=paragraph_index,
+                                  text=text)
+
+
+def iter_paragraphs(books: List[str]) -> Iterator[ParagraphRecord]:
+    """
+    Lazily read the paragraphs of every book, numbering books from 1.
+    """
+    for i_book, input_path in enumerate(books):
+        yield from iter_book_paragraphs(input_path, i_book + 1)
+
+
+def chapter_text(chapter: ChapterRecord) -> str:
+    return " ".join(chapter.paragraphs)
@@ -0,0 +1,82 @@
+from bisect import bisect_left, insort
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+# most hits first, then the lemma seen first
+RankKey = Tuple
+
+
+class FrequencyRanking:
+    """
+    Lemmas in rank order, kept up to date as counts change.
+    The owner calls touch when the count of a lemma changes. Touched lemmas are moved to their new place the next
+    time the ranking is read: one by one with bisect when few changed, with one sort when many changed.
+    The ranking is pickled with its owner, so a loaded counter doesn't sort anything.
+    Lemmas are whatever the owner keys them on, DeluxeTokenCounter uses string ids.
+    """
+    # above this share of touched lemmas, sorting everything again is faster than moving lemmas one by one
+    RESORT_SHARE = 1 / 16
+
+    def __init__(self):
+        self._keys: List[RankKey] = []  # sorted rank keys, the lemma is the last item
+        self._key_by_lemma: Dict[Hashable, RankKey] = {}
+        self._touched: Set[Hashable] = set()
+
+    def __getstate__(self):
+        # the lemma is the last item of its key, so the lookup is rebuilt from the keys instead of being pickled
+        state = self.__dict__.copy()
+        del state["_key_by_lemma"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._key_by_lemma = {x[-1]: x for x in self._keys}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def touch(self, lemma: Hashable):
+        self._touched.add(lemma)
+
+    def touch_all(self, lemmas: Iterable[Hashable]):
+        self._touched.update(lemmas)
+
+    def refresh(self, get_rank_key: Callable[[Hashable], Optional[RankKey]]):
+        """
+        Move touched lemmas to their new place.
+        :param get_rank_key: the rank key of a lemma, ending with the lemma, or None if the lemma is gone
+        """
+        if len(self._touched) == 0:
+            return
+        if len(self._touched) > len(self._keys) * FrequencyRanking.RESORT_SHARE:
+            for lemma in self._touched:
+                key = get_rank_key(lemma)
+                if key is None:
+                    self._key_by_lemma.pop(lemma, None)
+                else:
+                    self._key_by_lemma[lemma] = key
+            self._keys = sorted(self._key_by_lemma.values())
+        else:
+            for lemma in self._touched:
+                old_key = self._key_by_lemma.pop(lemma, None)
+                if old_key is not None:
+                    del self._keys[bisect_left(self._keys, old_key)]
+                key = get_rank_key(lemma)
+                if key is not None:
+                    self._key_by_lemma[lemma] = key
+                    insort(self._keys, key)
+        self._touched = set()
+
+    def top(self, k: int) -> List[Hashable]:
+        return self.range(0, k)
+
+    def range(self, start: int, stop: int) -> List[Hashable]:
+        """
+        :return: the lemmas ranked start (0 is the most common) up to but not including stop
+        """
+        return [x[-1] for x in self._keys[start:stop]]
+
+    def rank_of(self, lemma: Hashable) -> Optional[int]:
+        key = self._key_by_lemma.get(lemma, None)
+        if key is None:
+            return None
+        return bisect_left(self._keys, key)
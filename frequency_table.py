@@ -0,0 +1,206 @@
+import mmap
+import os
+import pickle
+from typing import List, Optional, Sized
+
+import numpy as np
+
+from deluxe_token_counter import DeluxeLemmaHit, DeluxeTokenCounter, get_deluxe_word_count, \
+    deluxe_hit_is_proper_noun
+from string_ids import get_string_id
+from util import get_books, get_book_hash
+
+# bumped when sections change, tables written in another version are exported again
+FORMAT_VERSION = 2
+
+# sections of the file, in file order, with their numpy types. Texts are utf-8 bytes with an offset array
+_SECTIONS = [
+    ("hits", np.int64),  # hits of each lemma, by rank
+    ("lemma_offsets", np.int64),  # offsets of each lemma in lemma_text, by rank, plus the end
+    ("lemma_text", np.uint8),  # the lower case lemmas, by rank
+    ("sorted_ids", np.uint64),  # string ids of the lemmas, sorted
+    ("sorted_ranks", np.int64),  # rank of each lemma, in the order of sorted_ids
+    ("detail_offsets", np.int64),  # offsets of each detail record in details, by rank, plus the end
+    ("details", np.uint8),  # the pickled DeluxeLemmaHit of each lemma, by rank
+    ("is_proper_noun", np.uint8),  # 1 for lemmas deluxe_hit_is_proper_noun drops, by rank
+    ("text_id_offsets", np.int64),  # offsets of the string ids of each lemma in text_ids, by rank, plus the end
+    ("text_ids", np.uint64),  # string ids of each lemma and every lower case text it was seen as, by rank
+]
+
+
+class FrequencyTable:
+    """
+    The lemma ranking of a DeluxeTokenCounter, exported to one file that is memory mapped when it is opened.
+    Opening it only reads a small header, so startup doesn't grow with the number of books. Lemmas and hits are
+    read straight from the mapped arrays, and the DeluxeLemmaHit of a lemma is unpickled when it is asked for.
+    The file is cache/<language>/FrequencyTable.bin, written by export:
+        8 bytes: length of the header
+        header: pickled dict with the format version, the book hashes and the (offset, length) of each section
+        sections: numpy arrays, see _SECTIONS, each starting on an 8 byte boundary
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as fin:
+            header_length = int.from_bytes(fin.read(8), 'little')
+            header = pickle.loads(fin.read(header_length))
+            self._mmap = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        self.book_hashes: List[str] = header["book_hashes"]
+        self.version: int = header.get("version", 1)
+        if self.version != FORMAT_VERSION:
+            # older tables lack sections, get_frequency_table exports them again
+            return
+        sections = {name: np.frombuffer(self._mmap, dtype=dtype, count=header["sections"][name][1],
+                                        offset=header["sections"][name][0]) for name, dtype in _SECTIONS}
+        self._hits = sections["hits"]
+        self._lemma_offsets = sections["lemma_offsets"]
+        self._lemma_text = sections["lemma_text"]
+        self._sorted_ids = sections["sorted_ids"]
+        self._sorted_ranks = sections["sorted_ranks"]
+        self._detail_offsets = sections["detail_offsets"]
+        self._details = sections["details"]
+        self._is_proper_noun = sections["is_proper_noun"]
+        self._text_id_offsets = sections["text_id_offsets"]
+        self._text_ids = sections["text_ids"]
+
+    def __len__(self) -> int:
+        return len(self._hits)
+
+    @staticmethod
+    def s_get_path(language: str) -> str:
+        return f"./cache/{language}/FrequencyTable.bin"
+
+    @staticmethod
+    def export(counter: DeluxeTokenCounter, path: str):
+        """
+        Write the ranking of a counter to a file that FrequencyTable can open.
+        """
+        lemmas = counter.get_lemmas_by_frequency()
+        infos = [counter.get_hit_info(x) for x in lemmas]
+        lemma_bytes = [x.encode('utf8') for x in lemmas]
+        details = [pickle.dumps(x, protocol=pickle.HIGHEST_PROTOCOL) for x in infos]
+        text_ids = [counter.get_string_ids(x) for x in lemmas]
+        ids = np.array([get_string_id(x) for x in lemmas], dtype=np.uint64)
+        order = np.argsort(ids, kind='stable')
+
+        def get_offsets(blobs: List[Sized]) -> np.ndarray:
+            offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+            np.cumsum([len(x) for x in blobs], out=offsets[1:])
+            return offsets
+
+        arrays = {
+            "hits": np.array([x['hits'] for x in infos], dtype=np.int64),
+            "lemma_offsets": get_offsets(lemma_bytes),
+            "lemma_text": np.frombuffer(b"".join(lemma_bytes), dtype=np.uint8),
+            "sorted_ids": ids[order],
+            "sorted_ranks": order.astype(np.int64),
+            "detail_offsets": get_offsets(details),
+            "details": np.frombuffer(b"".join(details), dtype=np.uint8),
+            "is_proper_noun": np.array([deluxe_hit_is_proper_noun(x) for x in infos], dtype=np.uint8),
+            "text_id_offsets": get_offsets(text_ids),
+            "text_ids": np.array([x for ids in text_ids for x in ids], dtype=np.uint64),
+        }
+
+        def get_header(start: int) -> bytes:
+            sections = {}
+            offset = start
+            for name, dtype in _SECTIONS:
+                sections[name] = (offset, len(arrays[name]))
+                offset += -(-arrays[name].nbytes // 8) * 8
+            return pickle.dumps({"version": FORMAT_VERSION, "book_hashes": list(counter.book_hashes),
+                                 "sections": sections})
+
+        # section offsets depend on the header length, which depends on the offsets: grow until they agree
+        header_length = 0
+        header = get_header(8)
+        while header_length != len(header):
+            header_length = len(header)
+            header = get_header(-(-(8 + header_length) // 8) * 8)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'wb') as fout:
+            fout.write(len(header).to_bytes(8, 'little'))
+            fout.write(header)
+            for name, _ in _SECTIONS:
+                fout.write(b"\0" * (-fout.tell() % 8))
+                fout.write(arrays[name].tobytes())
+        # an interrupted export never leaves half a table behind
+        os.replace(temp_path, path)
+
+    def _get_lemma(self, rank: int) -> str:
+        return self._lemma_text[self._lemma_offsets[rank]:self._lemma_offsets[rank + 1]].tobytes().decode('utf8')
+
+    def get_rank(self, lemma: str) -> Optional[int]:
+        """
+        :return: starting at 0, the rank of a lemma, or None if it was never counted
+        """
+        string_id = np.uint64(get_string_id(lemma))
+        i = int(np.searchsorted(self._sorted_ids, string_id))
+        if (i >= len(self._sorted_ids)) or (self._sorted_ids[i] != string_id):
+            return None
+        return int(self._sorted_ranks[i])
+
+    def get_hits(self, lemma: str) -> int:
+        rank = self.get_rank(lemma)
+        return 0 if rank is None else int(self._hits[rank])
+
+    def get_hit_info(self, lemma: str) -> Optional[DeluxeLemmaHit]:
+        """
+        :param lemma: a lower case lemma
+        """
+        rank = self.get_rank(lemma)
+        if rank is None:
+            return None
+        return pickle.loads(self._details[self._detail_offsets[rank]:self._detail_offsets[rank + 1]].tobytes())
+
+    def get_top_lemmas(self, k: int) -> List[str]:
+        return self.get_lemmas_in_rank_range(0, k)
+
+    def get_lemmas_in_rank_range(self, start: int, stop: int) -> List[str]:
+        """
+        :param start: starting at 0, the first rank to return
+        :param stop: the rank after the last rank to return
+        """
+        return [self._get_lemma(x) for x in range(max(start, 0), min(stop, len(self)))]
+
+    def get_lemmas_by_frequency(self) -> List[str]:
+        return self.get_lemmas_in_rank_range(0, len(self))
+
+    def get_hits_by_rank(self) -> np.ndarray:
+        """
+        :return: hits of every lemma, by rank
+        """
+        return self._hits
+
+    def get_proper_nouns_by_rank(self) -> np.ndarray:
+        """
+        :return: for every lemma by rank, whether deluxe_hit_is_proper_noun is true of it
+        """
+        return self._is_proper_noun.astype(bool)
+
+    def get_seen_by_rank(self, seen_ids: np.ndarray) -> np.ndarray:
+        """
+        Same as PreviouslyImportedWords.has_seen_info for the DeluxeLemmaHit of every lemma, without unpickling any.
+        :param seen_ids: string ids of lower case words and lemmas, as from get_seen_word_or_lemma_ids
+        :return: for every lemma by rank, whether the lemma or any text it was seen as is in seen_ids
+        """
+        seen_before = np.zeros(len(self._text_ids) + 1, dtype=np.int64)
+        np.cumsum(np.isin(self._text_ids, seen_ids), out=seen_before[1:])
+        return seen_before[self._text_id_offsets[1:]] > seen_before[self._text_id_offsets[:-1]]
+
+    @staticmethod
+    def load(language: str) -> Optional["FrequencyTable"]:
+        path = FrequencyTable.s_get_path(language)
+        return FrequencyTable(path) if os.path.exists(path) else None
+
+
+def get_frequency_table(language: str) -> FrequencyTable:
+    """
+    Open the frequency table, exporting it from the word count first when the books changed.
+    """
+    table = FrequencyTable.load(language)
+    if (table is not None) and (table.version == FORMAT_VERSION) and \
+            (table.book_hashes == [get_book_hash(x) for x in get_books(language)]):
+        return table
+    print("exporting frequency table from the word count")
+    FrequencyTable.export(get_deluxe_word_count(language), FrequencyTable.s_get_path(language))
+    return FrequencyTable.load(language)
@@ -20,8 +20,7 @@ from basic_token_counter import get_basic_word_count
 from translator import Translation
 from csv_output import save_words_to_csv
 import csv
-import spacy
-from util import language_to_code
+from nlp_pipelines import get_nlp
 
 
 def get_word_map(language: str, books: [str], nlp: SpacyLanguage) -> Dict[str, WordLocInfo]:
@@ -89,7 +88,7 @@ def import_top_5000(language: str, books: [str]):
     token_count = get_basic_word_count(language, books)
     trans = Translation.load(language)
 
-    print("got raw words", len(raw_words._words_seen.keys()))
+    print("got raw words", raw_words.count_unique())
     path = './spanish/top_5000_spanish_words.csv'
     new_words: List[str] = []
     with open(path, 'r') as fin:
@@ -102,7 +101,7 @@ def import_top_5000(language: str, books: [str]):
                     new_words.append(the_word)
 
     print("new words =", len(new_words), new_words[0:100])
-    nlp = spacy.load(language_to_code(language) + "_core_news_lg")
+    nlp = get_nlp(language)
     map_word_to_sentence = get_word_map(language, books, nlp)
 
     # new_words # 990 total
@@ -0,0 +1,318 @@
+"""
+One pass over the books that feeds every token to any number of counters.
+Counters register themselves with @register_counter and implement:
+    add_token(token, book, chapter): count one token
+    merge(other, book): add the counts of a counter of any other part of the text. If book is set, the other
+    counter was counted as book 1 and is added as book number `book`. Merges can be done in any order.
+and optionally, instead of add_token:
+    add_doc(doc, doc_array, book, chapter): count a whole doc, with the columns of get_doc_array
+Counters that keep what they saw first also have subtract(other, book), to take away the counts of a book.
+Each book is counted once into a shard per counter (cache/<language>/<counter class>/<book hash>.pickle)
+and the shards are merged into the series counters, which are saved with PicklingBaseClass.save.
+While a book is counted its partial counts are saved every CHECKPOINT_SECONDS, so an interrupted count
+carries on where it stopped.
+"""
+import multiprocessing
+import os
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple, Type, TYPE_CHECKING
+
+import numpy as np
+
+from chapter_manifest import ChapterManifest
+from epub_stream import chapter_text
+from pickling_base import PicklingBaseClass
+from string_ids import get_string_id
+from util import get_books, get_book_hash
+
+if TYPE_CHECKING:
+    from spacy import Language as SpacyLanguage
+    from spacy.tokens import Doc
+
+# spacy, the DocStore and the pipelines are imported when something is counted, so loading a cached counter
+# doesn't import spacy
+
+_counter_registry: Dict[str, Type[PicklingBaseClass]] = {}
+
+# seconds between saves of the partial counts of a book
+CHECKPOINT_SECONDS = 60
+
+
+def register_counter(klass: Type[PicklingBaseClass]) -> Type[PicklingBaseClass]:
+    _counter_registry[klass.__name__] = klass
+    return klass
+
+
+def get_registered_counters() -> List[Type[PicklingBaseClass]]:
+    return list(_counter_registry.values())
+
+
+# columns of get_doc_array
+DOC_LEMMA, DOC_LOWER, DOC_POS, DOC_IS_ALPHA, DOC_IS_STOP, DOC_SENT_START, DOC_ORTH, DOC_MORPH, DOC_LOWER_LEMMA = \
+    range(9)
+# columns holding strings. They hold string ids, see string_ids
+DOC_STRING_COLUMNS = [DOC_LEMMA, DOC_LOWER, DOC_ORTH, DOC_MORPH, DOC_LOWER_LEMMA]
+
+# spacy gives its own symbols (like "number" or "root") small fixed ids instead of the hash of their text.
+# get_doc_array swaps these for string ids, and this is where their text is found again
+_symbol_texts: Dict[int, str] = {}
+
+
+def get_doc_array(doc: 'Doc') -> np.ndarray:
+    """
+    Every token of a doc as a row of lemma, lower case text, part of speech id, is alpha, is stop word,
+    sentence start (1 for the first token of a sentence), text, morphology (like "Mood=Ind|Tense=Pres", "_" for
+    none) and lower case lemma, so counters can count a doc without touching tokens.
+    Strings are string ids (see string_ids), get_doc_string turns them back into text.
+    """
+    from spacy.attrs import LEMMA, LOWER, POS, IS_ALPHA, IS_STOP, SENT_START, ORTH, MORPH
+    from spacy.symbols import IDS
+
+    doc_array = doc.to_array([LEMMA, LOWER, POS, IS_ALPHA, IS_STOP, SENT_START, ORTH, MORPH])
+    strings = doc.vocab.strings
+    lemma_hashes, inverse = np.unique(doc_array[:, DOC_LEMMA], return_inverse=True)
+    # adding the lower case lemmas to the string store lets counters turn their ids back into text
+    lower_lemma_hashes = np.array([strings.add(strings[x].lower()) for x in lemma_hashes.tolist()], dtype=np.uint64)
+    doc_array = np.column_stack([doc_array, lower_lemma_hashes[inverse.reshape(-1)]])
+    for column in DOC_STRING_COLUMNS:
+        values = doc_array[:, column]
+        is_symbol = values < len(IDS)
+        if not is_symbol.any():
+            continue
+        for symbol in np.unique(values[is_symbol]).tolist():
+            text = strings[symbol]
+            string_id = get_string_id(text)
+            _symbol_texts[string_id] = text
+            values[values == symbol] = string_id
+    return doc_array
+
+
+def get_doc_string(doc: 'Doc', string_id: int) -> str:
+    """
+    :return: the text of a string id from get_doc_array, or of a part of speech id
+    """
+    text = _symbol_texts.get(string_id, None)
+    return doc.vocab.strings[string_id] if text is None else text
+
+
+def get_first_occurrences(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :param keys: an array of keys, or a 2d array with one key per row
+    :return: the distinct keys, the index of the first occurrence of each and how often each occurs,
+    in order of first occurrence
+    """
+    # rows of a 2d array are compared whole, so pairs of hashes don't need to be combined into one key
+    unique_keys, first_indexes, counts = np.unique(keys, return_index=True, return_counts=True, axis=0)
+    order = np.argsort(first_indexes)
+    return unique_keys[order], first_indexes[order], counts[order]
+
+
+def get_sentence_starts(doc_array: np.ndarray) -> np.ndarray:
+    """
+    :return: sorted token indexes where sentences start. Use with np.searchsorted(starts, i, 'right') - 1.
+    """
+    starts = np.flatnonzero(doc_array[:, DOC_SENT_START] == 1)
+    if (len(doc_array) > 0) and ((len(starts) == 0) or (starts[0] != 0)):
+        starts = np.concatenate([[0], starts])
+    return starts
+
+
+def read_book_chapters(language: str, books: List[str]) -> List[Tuple[int, int, str]]:
+    """
+    Read the text chapters of every book.
+    :return: a list of (book number, chapter number, chapter text), both numbers starting at 1
+    """
+    chapters = []
+    manifest = ChapterManifest(language)
+    i_book = 0
+    for input_path in books:
+        i_book += 1
+        print("=" * 40, "read book", i_book, input_path)
+        for chapter in manifest.iter_chapters(input_path, i_book):
+            print(f"chapter {chapter.chapter} length is {chapter.body_length}")
+            chapters.append((i_book, chapter.chapter, chapter_text(chapter)))
+    return chapters
+
+
+def count_chapters(language: str, nlp: 'SpacyLanguage', chapters: List[Tuple[int, int, str]],
+                   counter_classes: List[Type[PicklingBaseClass]], batch_size: int,
+                   counters: Optional[List[PicklingBaseClass]] = None) -> List[PicklingBaseClass]:
+    """
+    Count a list of (book number, chapter number, chapter text) into a counter of each class.
+    :param counters: counters to add to, in the order of counter_classes. The default is new counters.
+    :return: the counters, in the order of counter_classes
+    """
+    from doc_store import DocStore
+
+    if counters is None:
+        counters = [klass(language) for klass in counter_classes]
+    doc_counters = [x for x in counters if hasattr(x, 'add_doc')]
+    token_counters = [x for x in counters if not hasattr(x, 'add_doc')]
+    texts = (text for _, _, text in chapters)
+    for (i_book, chapter_num, _), doc in zip(chapters, DocStore(language, nlp).pipe(texts, batch_size=batch_size)):
+        if len(doc_counters) > 0:
+            doc_array = get_doc_array(doc)
+            for counter in doc_counters:
+                counter.add_doc(doc, doc_array, i_book, chapter_num)
+        if len(token_counters) > 0:
+            for token in doc:
+                for counter in token_counters:
+                    counter.add_token(token, i_book, chapter_num)
+        print("counted book", i_book, "chapter", chapter_num)
+    return counters
+
+
+def _init_count_worker(language: str, pipeline_size: str):
+    # each worker process loads its own pipeline once, before the first task
+    from nlp_pipelines import set_pipeline_size, warm_up
+
+    set_pipeline_size(pipeline_size)
+    warm_up(language, ['count'])
+
+
+def _count_chapters_in_worker(args) -> List[PicklingBaseClass]:
+    # only the partial counters are sent back to the parent process, never the Doc objects
+    from nlp_pipelines import get_nlp
+
+    language, chapters, counter_classes, batch_size = args
+    return count_chapters(language, get_nlp(language, 'count'), chapters, counter_classes, batch_size)
+
+
+def count_chapters_in_parallel(language: str, chapters: List[Tuple[int, int, str]],
+                               counter_classes: List[Type[PicklingBaseClass]], batch_size: int, n_process: int,
+                               counters: Optional[List[PicklingBaseClass]] = None,
+                               on_counted: Optional[Callable[[List[Tuple[int, int, str]]], None]] = None
+                               ) -> List[PicklingBaseClass]:
+    """
+    Like count_chapters, but with n_process worker processes. Each process counts a run of consecutive chapters
+    into its own partial counters, which are merged into the counters.
+    :param counters: counters to add to, in the order of counter_classes. The default is new counters.
+    :param on_counted: called with each run of batch_size chapters once it is in the counters
+    """
+    from nlp_pipelines import get_nlp, get_pipeline_size
+
+    if counters is None:
+        counters = [klass(language) for klass in counter_classes]
+    runs = [chapters[i:i + batch_size] for i in range(0, len(chapters), batch_size)]
+    if n_process <= 1:
+        nlp = get_nlp(language, 'count')
+        for run in runs:
+            count_chapters(language, nlp, run, counter_classes, batch_size, counters)
+            if on_counted is not None:
+                on_counted(run)
+        return counters
+
+    tasks = [(language, run, counter_classes, batch_size) for run in runs]
+    with multiprocessing.Pool(n_process, initializer=_init_count_worker,
+                              initargs=(language, get_pipeline_size())) as pool:
+        # merges can be done in any order, but imap keeps the order chapters and lemmas are first seen in
+        for run, partial_counters in zip(runs, pool.imap(_count_chapters_in_worker, tasks)):
+            for counter, partial_counter in zip(counters, partial_counters):
+                counter.merge(partial_counter)
+            if on_counted is not None:
+                on_counted(run)
+    return counters
+
+
+class CountCheckpoint(PicklingBaseClass):
+    """
+    The partial counters of a book that is being counted and the chapters already in them.
+    Saved as a shard of the book, and removed once the shards of the counters are saved.
+    """
+    def __init__(self, language: str):
+        self.counters: Dict[str, PicklingBaseClass] = {}
+        self.chapters_done: Set[Tuple[int, int]] = set()
+        super().__init__(language)
+
+    def remove_shard(self, shard: str):
+        shard_path = PicklingBaseClass.s_get_shard_path(self.language, self.__class__, shard)
+        if os.path.exists(shard_path):
+            os.remove(shard_path)
+
+
+def count_chapters_with_checkpoints(language: str, book_hash: str, chapters: List[Tuple[int, int, str]],
+                                    counter_classes: List[Type[PicklingBaseClass]], batch_size: int,
+                                    n_process: int) -> List[PicklingBaseClass]:
+    """
+    Like count_chapters_in_parallel for the chapters of one book, saving the partial counts every
+    CHECKPOINT_SECONDS and when counting stops with an exception. Chapters in a saved checkpoint are not counted
+    again. Call CountCheckpoint.remove_shard once the counters are saved.
+    """
+    checkpoint = PicklingBaseClass.s_load_shard_if_exists(language, CountCheckpoint, book_hash)
+    if (checkpoint is None) or (set(checkpoint.counters.keys()) != {x.__name__ for x in counter_classes}):
+        checkpoint = CountCheckpoint(language)
+        checkpoint.counters = {x.__name__: x(language) for x in counter_classes}
+    else:
+        print("carrying on from a checkpoint with", len(checkpoint.chapters_done), "chapters counted")
+    counters = [checkpoint.counters[x.__name__] for x in counter_classes]
+    last_save = time.time()
+
+    def on_counted(run: List[Tuple[int, int, str]]):
+        nonlocal last_save
+        checkpoint.chapters_done.update((x[0], x[1]) for x in run)
+        if time.time() - last_save > CHECKPOINT_SECONDS:
+            checkpoint.save_shard(book_hash)
+            last_save = time.time()
+
+    remaining = [x for x in chapters if (x[0], x[1]) not in checkpoint.chapters_done]
+    try:
+        count_chapters_in_parallel(language, remaining, counter_classes, batch_size, n_process, counters, on_counted)
+    except BaseException:
+        if len(checkpoint.chapters_done) > 0:
+            print("saving a checkpoint with", len(checkpoint.chapters_done), "chapters counted")
+            checkpoint.save_shard(book_hash)
+        raise
+    return counters
+
+
+def count_book(language: str, input_path: str, book_hash: str, counter_classes: List[Type[PicklingBaseClass]],
+               batch_size: int = 4, n_process: int = 1) -> List[PicklingBaseClass]:
+    """
+    Load the shard of a single book for each counter class. Counters without a shard are counted together in
+    one pass over the book and their shards are saved. The book is always counted as book 1.
+    :return: the shards, in the order of counter_classes
+    """
+    shards = [PicklingBaseClass.s_load_shard_if_exists(language, klass, book_hash) for klass in counter_classes]
+    missing = [klass for klass, shard in zip(counter_classes, shards) if shard is None]
+    if len(missing) > 0:
+        print("no shards for", input_path, [x.__name__ for x in missing], "counting the hard way")
+        chapters = read_book_chapters(language, [input_path])
+        counted = dict(zip(missing, count_chapters_with_checkpoints(language, book_hash, chapters, missing,
+                                                                    batch_size, n_process)))
+        for klass, shard in counted.items():
+            shard.save_shard(book_hash)
+        CountCheckpoint(language).remove_shard(book_hash)
+        shards = [counted[klass] if shard is None else shard for klass, shard in zip(counter_classes, shards)]
+    return shards
+
+
+def ingest(language: str, counter_classes: Optional[List[Type[PicklingBaseClass]]] = None,
+           books: Optional[List[str]] = None, batch_size: int = 4,
+           n_process: int = 1) -> Dict[Type[PicklingBaseClass], PicklingBaseClass]:
+    """
+    Build and save every counter in one pass over the books.
+    :param language: the language
+    :param counter_classes: the counters to build. The default is every registered counter without a cache.
+    :param books: paths to the books, default is every book in <language>/books
+    :param batch_size: number of chapters spacy parses together (nlp.pipe batch_size)
+    :param n_process: number of processes to count with
+    :return: the new counters by class
+    """
+    if counter_classes is None:
+        counter_classes = [x for x in get_registered_counters()
+                           if not os.path.exists(PicklingBaseClass.s_get_cache_path(language, x))]
+    if books is None:
+        books = get_books(language)
+    book_hashes = [get_book_hash(x) for x in books]
+
+    counters = [klass(language) for klass in counter_classes]
+    for i_book, (input_path, book_hash) in enumerate(zip(books, book_hashes)):
+        shards = count_book(language, input_path, book_hash, counter_classes, batch_size, n_process)
+        for counter, shard in zip(counters, shards):
+            counter.merge(shard, i_book + 1)
+
+    for counter in counters:
+        if hasattr(counter, 'book_hashes'):
+            counter.book_hashes = book_hashes
+        counter.save()
+    return dict(zip(counter_classes, counters))
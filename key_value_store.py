@@ -0,0 +1,186 @@
+import atexit
+import os
+import pickle
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, MutableMapping, Optional, Tuple
+
+
+class _Database:
+    """
+    One sqlite file, shared by the stores in its tables. The connection is used from the flusher thread too,
+    so every use takes the lock.
+    """
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.stores: List["KeyValueStore"] = []
+        self.flush_seconds: Optional[float] = None
+        self._wake = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def start_flusher(self, flush_seconds: float):
+        """
+        Write the pending entries of every write-behind store at least every flush_seconds, and at exit.
+        """
+        if (self.flush_seconds is None) or (flush_seconds < self.flush_seconds):
+            self.flush_seconds = flush_seconds
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._run_flusher, name="key value store flusher", daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+
+    def _run_flusher(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def wake_flusher(self):
+        self._wake.set()
+
+    def flush(self):
+        with self.lock:
+            with self.connection:
+                for store in self.stores:
+                    store._write_pending()
+
+
+# one database per file
+_databases: Dict[str, _Database] = {}
+
+
+def _get_database(db_path: str) -> _Database:
+    database = _databases.get(db_path, None)
+    if database is None:
+        database = _Database(db_path)
+        _databases[db_path] = database
+    return database
+
+
+class KeyValueStore(MutableMapping[str, Any]):
+    """
+    A dict kept in a table of an sqlite file, for lookup caches that grow one entry at a time.
+    Setting a key writes one row and reading a key reads one row, so nothing is rewritten as the cache grows.
+    Keys are text and values are pickled. Values read from the store are copies: after changing one,
+    set it again.
+    With flush_seconds set, writes are write-behind: they are kept in memory and a background thread writes
+    them in one transaction every flush_seconds, as soon as max_pending are waiting, on flush and at exit.
+    A crash loses at most flush_seconds of writes.
+    """
+    def __init__(self, db_path: str, table: str, flush_seconds: Optional[float] = None, max_pending: int = 200):
+        self.db_path = db_path
+        self.table = table
+        self.max_pending = max_pending
+        # key -> pickled value, or None to delete the key. Only used for write-behind
+        self._pending: Dict[str, Optional[bytes]] = {}
+        self._database = _get_database(db_path)
+        self.connection = self._database.connection
+        with self._database.lock, self.connection:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB)")
+            self._database.stores.append(self)
+        self.flush_seconds = flush_seconds
+        if flush_seconds is not None:
+            self._database.start_flusher(flush_seconds)
+
+    def __getitem__(self, key: str) -> Any:
+        with self._database.lock:
+            if key in self._pending:
+                value = self._pending[key]
+            else:
+                row = self.connection.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                value = row[0] if row is not None else None
+        if value is None:
+            raise KeyError(key)
+        return pickle.loads(value)
+
+    def get(self, key: str, default: Optional[Any] = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key: str, value: Any):
+        # pickled now, so changes made to the value after it is set aren't written
+        value = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._database.lock:
+            if self.flush_seconds is not None:
+                self._pending[key] = value
+                if len(self._pending) >= self.max_pending:
+                    self._database.wake_flusher()
+                return
+            with self.connection:
+                self.connection.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?)", (key, value))
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        with self._database.lock:
+            if self.flush_seconds is not None:
+                self._pending[key] = None
+                return
+            with self.connection:
+                self.connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def __contains__(self, key: object) -> bool:
+        with self._database.lock:
+            if key in self._pending:
+                return self._pending[key] is not None
+            return self.connection.execute(f"SELECT 1 FROM {self.table} WHERE key = ?",
+                                           (key,)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        self.flush()
+        with self._database.lock:
+            return iter([x[0] for x in self.connection.execute(f"SELECT key FROM {self.table}")])
+
+    def __len__(self) -> int:
+        self.flush()
+        with self._database.lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def set_many(self, items: Iterable[Tuple[str, Any]]):
+        """
+        Set many keys in one transaction.
+        """
+        self.flush()
+        with self._database.lock, self.connection:
+            self.connection.executemany(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?)",
+                                        ((k, pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL)) for k, v in items))
+
+    def _write_pending(self):
+        # called by the database with its lock held, inside a transaction
+        if len(self._pending) == 0:
+            return
+        pending = self._pending
+        self._pending = {}
+        self.connection.executemany(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?)",
+                                    [(k, v) for k, v in pending.items() if v is not None])
+        self.connection.executemany(f"DELETE FROM {self.table} WHERE key = ?",
+                                    [(k,) for k, v in pending.items() if v is None])
+
+    def flush(self):
+        """
+        Write every pending entry of every store in the same file now.
+        """
+        self._database.flush()
+
+
+def get_store_path(language: str, name: str) -> str:
+    return f"./cache/{language}/{name}.sqlite"
+
+
+def migrate_pickle(pickle_path: str, migrate: Callable[[Any], None]):
+    """
+    Move an older pickled cache into key value stores, once.
+    :param pickle_path: the path of the pickled cache
+    :param migrate: called with the unpickled object, copies its entries into the stores
+    The pickle is renamed to <pickle_path>.migrated afterwards, so it is kept but not read again.
+    """
+    if not os.path.exists(pickle_path):
+        return
+    print("moving", pickle_path, "into an sqlite store")
+    with open(pickle_path, 'rb') as fin:
+        migrate(pickle.load(fin))
+    os.replace(pickle_path, pickle_path + ".migrated")
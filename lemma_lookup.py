@@ -1,11 +1,11 @@
-from my_wiktionary_parser import MyWiktionaryParser as WiktionaryParser
-from my_wiktionary_parser import LemmaResults
-from my_wiktionary_parser import WikiWord
-
+from key_value_store import KeyValueStore, get_store_path, migrate_pickle
 from pickling_base import PicklingBaseClass
-from typing import List, Optional
+from typing import List, Optional, TYPE_CHECKING
 from util import get_biggest_word
-from spacy.tokens.token import Token
+
+if TYPE_CHECKING:
+    from spacy.tokens.token import Token
+    from my_wiktionary_parser import MyWiktionaryParser, LemmaResults
 
 
 _pos_to_type = {
@@ -24,7 +24,7 @@ _pos_to_type = {
 }
 
 
-def token_to_wiktionary_type(token: Token) -> str:
+def token_to_wiktionary_type(token: 'Token') -> str:
     return _pos_to_type.get(token.pos_, 'unknown')
 
 
@@ -33,37 +33,40 @@ class LemmaLookup(PicklingBaseClass):
     This class looks up lemmas from Wiktionary.
     It uses WiktionaryParser to get the Wiktionary entry for a word and then parses the response to extract
     lemmas and parts of speach.
-    Lookups are saved in the pickle cache.
+    Lookups are saved in cache/<language>/LemmaLookup.sqlite as they are made, one row per word.
     """
     def __init__(self, language: str):
         self.language = language
-        self._lemmas_by_word = {}
-        self.parser = WiktionaryParser()
-        self.parser.set_default_language(language)
-        self.parser.exclude_relation("related terms")
+        self._lemmas_by_word = KeyValueStore(get_store_path(language, 'LemmaLookup'), 'lemmas')
+        self._parser: Optional["MyWiktionaryParser"] = None
         self.dirty_count = 0
         super().__init__(language)
 
-    def __getstate__(self):
-        state = self.__dict__.copy()
-        # Don't pickle these
-        del state["parser"]
-        del state['dirty_count']
-        return state
-
-    def __setstate__(self, state):
-        self.__dict__.update(state)
-        self.parser = WiktionaryParser()
-        self.parser.set_default_language(self.language)
-        self.parser.exclude_relation("related terms")
+    @property
+    def parser(self) -> "MyWiktionaryParser":
+        # the parser imports bs4 and requests_cache, which commands that only read cached lemmas don't need
+        if self._parser is None:
+            from my_wiktionary_parser import MyWiktionaryParser
+            self._parser = MyWiktionaryParser()
+            self._parser.set_default_language(self.language)
+            self._parser.exclude_relation("related terms")
+        return self._parser
+
+    def save(self):
+        # each lookup is written to the store when it is made
         self.dirty_count = 0
-        # Add baz back since it doesn't exist in the pickle
-        # self._nearby_word_info = None
 
-    def _add(self, text: str, lemmas: List[LemmaResults]):
-        self._lemmas_by_word[text] = lemmas
+    def _migrate(self, old: "LemmaLookup"):
+        if "_words" in old.__dict__:
+            # keyed on string ids
+            self._lemmas_by_word.set_many((old._words.get_text(k), v) for k, v in old._lemmas_by_word.items())
+        else:
+            self._lemmas_by_word.set_many(old._lemmas_by_word.items())
 
-    def get_best_token_lemma(self, token: Token) -> Optional[LemmaResults]:
+    def get_words(self) -> List[str]:
+        return list(self._lemmas_by_word)
+
+    def get_best_token_lemma(self, token: 'Token') -> Optional["LemmaResults"]:
         """
         Given a token, return a single lemma result. This won't always be correct.
         :param token:
@@ -80,30 +83,30 @@ class LemmaLookup(PicklingBaseClass):
         else:
             return matching_lemmas[0]
 
-    def get_lemmas(self, text: str) -> List[LemmaResults]:
+    def get_lemmas(self, text: str) -> List["LemmaResults"]:
         text = get_biggest_word(text.lower())
-        if text in self._lemmas_by_word:
-            return self._lemmas_by_word[text]
+        lemmas = self._lemmas_by_word.get(text, None)
+        if lemmas is not None:
+            return lemmas
         else:
             print("lemma lookup fetch lemmas for", text, end='')
+            from my_wiktionary_parser import WikiWord
             lemmas = self.parser.fetch_lemma(WikiWord(word=text, language=self.language))
             print(" GOT:", str(lemmas))
             self._lemmas_by_word[text] = lemmas
-            self.dirty_count += 1
-            if self.dirty_count >= 20:
-                self.save()
-                self.dirty_count = 0
             return lemmas
 
     @staticmethod
     def load(language: str) -> "LemmaLookup":
-        return PicklingBaseClass.s_load(language, LemmaLookup)
+        lemma_lookup = LemmaLookup(language)
+        migrate_pickle(PicklingBaseClass.s_get_cache_path(language, LemmaLookup), lemma_lookup._migrate)
+        return lemma_lookup
 
 
 if __name__ == '__main__':
     lemma_lookup = LemmaLookup.load('spanish')
     print(lemma_lookup.get_lemmas('avergonzar él'))
-    for key in list(lemma_lookup._lemmas_by_word.keys()):
+    for key in lemma_lookup.get_words():
         if len(key.split(' ')) > 1:
             print(key, "=>", lemma_lookup.get_lemmas(key))
 
@@ -1,53 +1,283 @@
-from by_chapter import create_chapter_words
+"""
+Command line entry point.
 
-from spacy import Language as SpacyLanguage
+IMPORTANT: The generated list of words needs to know what you have previously imported into Anki.
+This is determined by looking at CSV files in the already_imported directory.
 
-import spacy
+YOU MUST MOVE IMPORTED CSV FILES INTO already_imported AFTER IMPORTING
 
-from util import language_to_code
+Each subcommand imports only the modules it needs, so quick queries don't pay for spacy and the translators.
 
-from most_common_words import output_most_common_new_words
+    python main.py chapter spanish --book 1 --start 1 --chapters 1
+    python main.py frequency spanish --words 21
+    python main.py count spanish --processes 4
+    python main.py left spanish
+    python main.py range spanish 1:3 1:7 --words 50
+    python main.py verbs spanish
+    python main.py verbs spanish --wiktionary
+    python main.py cache spanish list
+    python main.py --import-time left spanish
+"""
+import argparse
+import os
+import sys
 
 
-def get_nlp(language: str) -> SpacyLanguage:
-    language_code = language_to_code(language)
-    spacy_pipeline = language_code + "_core_news_lg"
-    try:
-        nlp = spacy.load(spacy_pipeline)
-        return nlp
-    except ImportError:
-        print(f"could not import spacy pipeline {spacy_pipeline}")
-        print(f"refer to https://spacy.io/models/{language_code}")
-        print(f"you may be install it like this: python -m spacy download {spacy_pipeline}")
-        raise
+def apply_pipeline_size(args: argparse.Namespace):
+    if args.size is not None:
+        from nlp_pipelines import set_pipeline_size as _set_pipeline_size
+        _set_pipeline_size(args.size)
 
 
-def go():
-    language = 'italian'
-    nlp = get_nlp(language)
+def run_chapter(args: argparse.Namespace):
+    """
+    Create a list of words corresponding to chapters.
+    Only include words that appear more than once (or whatever frequency you set)
+    I found this to be useful when I was starting and needed a lof of help with vocab.
+    """
+    from by_chapter import create_chapter_words
+    from nlp_pipelines import get_nlp
+
+    apply_pipeline_size(args)
+    nlp = get_nlp(args.language, 'chapter')
+    create_chapter_words(args.language, book_number=args.book, start_chapter=args.start, num_chapters=args.chapters,
+                         min_word_frequency=args.min_frequency, nlp=nlp)
+
 
-    create_by_chapters = False
+def run_frequency(args: argparse.Namespace):
     """
-    IMPORTANT: The generated list of words needs to know what you have previously imported into Anki.
-    This is determined by looking at CSV files in the already_imported directory.
-    
-    YOU MUST MOVE IMPORTED CSV FILES INTO already_imported AFTER IMPORTING
+    Create a list of words ordered by frequency in a set of books.
+    This was useful once my vocabulary was good enough to understand most of what I was reading.
     """
-    if create_by_chapters:
-        """
-        Create a list of words corresponding to chapters. 
-        Only include words that appear more than once (or whatever frequency you set) 
-        I found this to be useful when I was starting and needed a lof of help with vocab.
-        """
-        create_chapter_words(language, book_number=1, start_chapter=1, num_chapters=1, min_word_frequency=2, nlp=nlp)
-    else:
-        """
-        Create a list of words ordered by frequency in a set of books.
-        This was useful once my vocabulary was good enough to understand most of what I was reading.
-        """
-        output_most_common_new_words(language, number_of_words_to_find=21, nlp=nlp)
-    return
+    from most_common_words import output_most_common_new_words
+    from nlp_pipelines import get_nlp
+
+    apply_pipeline_size(args)
+    nlp = get_nlp(args.language, 'emphasis')  # only used to highlight words in sample sentences
+    output_most_common_new_words(args.language, number_of_words_to_find=args.words, nlp=nlp)
+
+
+def run_count(args: argparse.Namespace):
+    from ingestion import ingest, get_registered_counters
+    # importing the counter modules registers them
+    import basic_token_counter
+    import chapter_count_matrix
+    import deluxe_token_counter
+    import raw_word_counter
+    import verb_counter
+
+    apply_pipeline_size(args)
+    counter_classes = None
+    if args.all:
+        counter_classes = get_registered_counters()
+    counters = ingest(args.language, counter_classes=counter_classes, batch_size=args.batch_size,
+                      n_process=args.processes)
+    if len(counters) == 0:
+        print("every counter is cached, use --all to count again")
+    for klass in counters.keys():
+        print("counted", klass.__name__)
+
+
+def run_left(args: argparse.Namespace):
+    """
+    How many lemmas in the books have not been imported yet.
+    """
+    from frequency_table import get_frequency_table
+    from lemma_lookup import LemmaLookup
+    from previously_imported_words import PreviouslyImportedWords
+
+    apply_pipeline_size(args)
+    lemma_lookup = LemmaLookup.load(args.language)
+    previously_imported_words = PreviouslyImportedWords.load_and_update(args.language, lemma_lookup)
+    table = get_frequency_table(args.language)
+    # read from the columns of the table, so no DeluxeLemmaHit is unpickled
+    hits = table.get_hits_by_rank()
+    is_new = (hits >= args.min_frequency) & ~table.get_proper_nouns_by_rank() & \
+        ~table.get_seen_by_rank(previously_imported_words.get_seen_word_or_lemma_ids())
+    new_lemmas = int(is_new.sum())
+    new_hits = int(hits[is_new].sum())
+    print(f"{new_lemmas} new lemmas with at least {args.min_frequency} hits, {new_hits} hits in total, "
+          f"out of {len(table)} lemmas")
+
+
+def parse_chapter(text: str) -> (int, int):
+    """
+    :param text: book:chapter, both starting at 1
+    """
+    book, chapter = text.split(':')
+    return int(book), int(chapter)
+
+
+def run_range(args: argparse.Namespace):
+    """
+    The most common new lemmas in a run of chapters.
+    """
+    import time
+    from chapter_count_matrix import get_chapter_count_matrix
+    from chapter_range_query import ChapterRangeQuery
+    from deluxe_token_counter import get_deluxe_word_count
+    from lemma_lookup import LemmaLookup
+    from previously_imported_words import PreviouslyImportedWords
+
+    apply_pipeline_size(args)
+    known_words = None
+    word_count = None
+    if not args.include_known:
+        known_words = PreviouslyImportedWords.load_and_update(args.language, LemmaLookup.load(args.language))
+        word_count = get_deluxe_word_count(args.language)
+    query = ChapterRangeQuery(get_chapter_count_matrix(args.language), known_words, word_count)
+    start_book, start_chapter = parse_chapter(args.start)
+    end_book, end_chapter = parse_chapter(args.end)
+    start = time.time()
+    top_lemmas = query.get_top_lemmas(start_book, start_chapter, end_book, end_chapter, args.words,
+                                      args.include_known)
+    for i, (lemma, hits) in enumerate(top_lemmas):
+        print(i + 1, lemma, hits)
+    print(f"query took {(time.time() - start) * 1000:.1f}ms")
+
+
+def run_verbs(args: argparse.Namespace):
+    from util import get_books
+    from verb_counter import dump_verbs
+
+    apply_pipeline_size(args)
+    # dump_verbs takes book paths relative to the language directory
+    dump_verbs(args.language, [os.path.relpath(x, args.language) for x in get_books(args.language)],
+               use_wiktionary=args.wiktionary)
+
+
+def get_path_size(path: str) -> (int, int):
+    """
+    :return: total size in bytes and number of files under a path
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path), 1
+    size = 0
+    num_files = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+            num_files += 1
+    return size, num_files
+
+
+def run_cache(args: argparse.Namespace):
+    import shutil
+
+    cache_path = os.path.join('cache', args.language)
+    if not os.path.isdir(cache_path):
+        print("no cache at", cache_path)
+        return
+    if args.action == 'list':
+        for name in sorted(os.listdir(cache_path)):
+            size, num_files = get_path_size(os.path.join(cache_path, name))
+            print(f"{size / (1 << 20):10.1f}MB {num_files:8} files  {name}")
+    elif args.action == 'clear':
+        if len(args.names) == 0:
+            print("name the cache entries to clear, see: cache", args.language, "list")
+        for name in args.names:
+            path = os.path.join(cache_path, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.isfile(path):
+                os.remove(path)
+            else:
+                print("no cache entry", name)
+                continue
+            print("cleared", path)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Create Anki flash cards for words in epub files.")
+    parser.add_argument('--import-time', action='store_true',
+                        help="run the command with python -X importtime and report the slowest imports")
+    parser.add_argument('--size', choices=['lg', 'md', 'sm'], default=None,
+                        help="spacy package size, sm uses much less memory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    chapter_parser = subparsers.add_parser('chapter', help="output new words chapter by chapter")
+    chapter_parser.add_argument('language')
+    chapter_parser.add_argument('--book', type=int, default=1, help="starting at 1, which book to read from")
+    chapter_parser.add_argument('--start', type=int, default=1, help="starting at 1, the first chapter to output")
+    chapter_parser.add_argument('--chapters', type=int, default=1, help="the number of chapters to output")
+    chapter_parser.add_argument('--min-frequency', type=int, default=2,
+                                help="only output words that appear at least this many times")
+    chapter_parser.set_defaults(run=run_chapter)
+
+    frequency_parser = subparsers.add_parser('frequency', help="output the most common new words in every book")
+    frequency_parser.add_argument('language')
+    frequency_parser.add_argument('--words', type=int, default=21, help="the number of words to output")
+    frequency_parser.set_defaults(run=run_frequency)
+
+    count_parser = subparsers.add_parser('count', help="count the books into every counter without a cache")
+    count_parser.add_argument('language')
+    count_parser.add_argument('--all', action='store_true', help="count every counter, even cached ones")
+    count_parser.add_argument('--processes', type=int, default=1, help="number of processes to count with")
+    count_parser.add_argument('--batch-size', type=int, default=4, help="number of chapters spacy parses together")
+    count_parser.set_defaults(run=run_count)
+
+    left_parser = subparsers.add_parser('left', help="how many new words are left in the books")
+    left_parser.add_argument('language')
+    left_parser.add_argument('--min-frequency', type=int, default=1,
+                             help="only count words that appear at least this many times")
+    left_parser.set_defaults(run=run_left)
+
+    range_parser = subparsers.add_parser('range', help="the most common new words in a run of chapters")
+    range_parser.add_argument('language')
+    range_parser.add_argument('start', help="first chapter, as book:chapter")
+    range_parser.add_argument('end', help="last chapter, as book:chapter")
+    range_parser.add_argument('--words', type=int, default=50, help="the number of words to show")
+    range_parser.add_argument('--include-known', action='store_true', help="include words already imported")
+    range_parser.set_defaults(run=run_range)
+
+    verbs_parser = subparsers.add_parser('verbs', help="show the most common verb forms")
+    verbs_parser.add_argument('language')
+    verbs_parser.add_argument('--wiktionary', action='store_true',
+                              help="look up the lemma of verb forms spacy gave more than one lemma in Wiktionary")
+    verbs_parser.set_defaults(run=run_verbs)
+
+    cache_parser = subparsers.add_parser('cache', help="list or clear the files in cache/<language>")
+    cache_parser.add_argument('language')
+    cache_parser.add_argument('action', choices=['list', 'clear'])
+    cache_parser.add_argument('names', nargs='*', help="the cache entries to clear, as shown by list")
+    cache_parser.set_defaults(run=run_cache)
+    return parser
+
+
+def report_import_time(argv: [str], top: int = 25):
+    """
+    Run the same command again with python -X importtime and show the imports with the biggest cumulative time.
+    """
+    import subprocess
+
+    command = [sys.executable, '-X', 'importtime', os.path.abspath(__file__)] + argv
+    result = subprocess.run(command, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:'):
+            print(line, file=sys.stderr)
+            continue
+        parts = line[len('import time:'):].split('|')
+        if (len(parts) != 3) or (not parts[1].strip().isdigit()):
+            continue
+        imports.append((int(parts[1]), int(parts[0]), parts[2].rstrip()))
+
+    imports.sort(key=lambda x: -x[0])
+    total = sum(x[1] for x in imports)
+    print(f"imports took {total / 1e6:.2f}s in total, slowest by cumulative time:")
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative, self_time, name in imports[:top]:
+        print(f"{cumulative / 1e6:11.3f}s {self_time / 1e6:9.3f}s {name}")
+
+
+def main(argv: [str]):
+    args = get_parser().parse_args(argv)
+    if args.import_time:
+        report_import_time([x for x in argv if x != '--import-time'])
+        return
+    args.run(args)
 
 
 if __name__ == '__main__':
-    go()
+    main(sys.argv[1:])
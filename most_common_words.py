@@ -4,10 +4,13 @@ from spacy import Language as SpacyLanguage
 import datetime
 
 from csv_output import save_infos_to_csv
-from deluxe_token_counter import DeluxeLemmaHit, get_deluxe_word_count, deluxe_hit_is_proper_noun
+from deluxe_token_counter import DeluxeLemmaHit, deluxe_hit_is_proper_noun
+from frequency_table import get_frequency_table
 from lemma_lookup import LemmaLookup
 from previously_imported_words import PreviouslyImportedWords
 
+RANK_CHUNK_SIZE = 500
+
 
 def get_deluxe_hit_roots(lemma_lookup: LemmaLookup, hit: DeluxeLemmaHit) -> List[Dict]:
     all_lemmas = lemma_lookup.get_lemmas(hit['lemma'])
@@ -17,13 +20,20 @@ def get_deluxe_hit_roots(lemma_lookup: LemmaLookup, hit: DeluxeLemmaHit) -> List
 def output_most_common_new_words(language: str, number_of_words_to_find: int, nlp: SpacyLanguage):
     lemma_lookup = LemmaLookup.load(language)
     previously_imported_words = PreviouslyImportedWords.load_and_update(language, lemma_lookup)
-    wc = get_deluxe_word_count(language)
-    lbf = wc.get_lemmas_by_frequency()
+    # the memory mapped table opens at once, hit info is only read for the lemmas looked at
+    wc = get_frequency_table(language)
     seen_roots = {}
     output_hits: List[DeluxeLemmaHit] = []
     i = 0
-    while (len(output_hits) < number_of_words_to_find) and (i < len(lbf)):
-        lemma = lbf[i]
+    lemmas = []
+    while len(output_hits) < number_of_words_to_find:
+        if len(lemmas) == 0:
+            # read the ranking a chunk at a time, most of the top lemmas are usually already imported
+            lemmas = wc.get_lemmas_in_rank_range(i, i + RANK_CHUNK_SIZE)
+            lemmas.reverse()
+            if len(lemmas) == 0:
+                break
+        lemma = lemmas.pop()
         i += 1
         info = wc.get_hit_info(lemma)
         if not previously_imported_words.has_seen_info(info):
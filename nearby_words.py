@@ -0,0 +1,111 @@
+from bisect import bisect_left
+from itertools import combinations
+from typing import Dict, Iterable, List, Set, Tuple
+
+# words that match all but their last few letters are looked up by (prefix, word length).
+# A word is indexed under its prefixes with the last 0, 1 and 2 letters dropped.
+MAX_DROPPED_LETTERS = 2
+
+
+def get_edit_distance(first: str, second: str, max_distance: int) -> int:
+    """
+    Levenshtein distance, or max_distance + 1 if it is bigger than max_distance.
+    """
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(second) + 1))
+    for i, first_letter in enumerate(first):
+        current = [i + 1]
+        for j, second_letter in enumerate(second):
+            current.append(min(previous[j + 1] + 1, current[j] + 1, previous[j] + (first_letter != second_letter)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+def get_deletes(word: str, max_deletes: int) -> Set[str]:
+    """
+    Every string made by deleting up to max_deletes letters from word, including word itself.
+    """
+    deletes = {word}
+    for num_deletes in range(1, min(max_deletes, len(word)) + 1):
+        for positions in combinations(range(len(word)), num_deletes):
+            deletes.add(''.join(x for i, x in enumerate(word) if i not in positions))
+    return deletes
+
+
+class NearbyWordIndex:
+    """
+    Lookups of words with similar spelling in a fixed vocabulary.
+    Build it once for a vocabulary and build a new one when the vocabulary changes.
+    """
+    def __init__(self, words: Iterable[str]):
+        self._words = set(words)
+        # (prefix, word length) -> number of words of that length starting with prefix
+        self._count_by_prefix: Dict[Tuple[str, int], int] = {}
+        # first 2 letters -> sorted words, last 4 letters -> sorted reversed words
+        self._by_first_2: Dict[str, List[str]] = {}
+        self._by_last_4: Dict[str, List[str]] = {}
+        # max edits -> (delete variant -> words). Built the first time each number of edits is asked for
+        self._words_by_delete: Dict[int, Dict[str, List[str]]] = {}
+
+        for word in self._words:
+            for dropped in range(0, min(MAX_DROPPED_LETTERS, len(word)) + 1):
+                key = (word[:len(word) - dropped], len(word))
+                self._count_by_prefix[key] = self._count_by_prefix.get(key, 0) + 1
+            self._by_first_2.setdefault(word[:2], []).append(word)
+            self._by_last_4.setdefault(word[-4:], []).append(word[::-1])
+        for word_list in self._by_first_2.values():
+            word_list.sort()
+        for word_list in self._by_last_4.values():
+            word_list.sort()
+
+    def has_word_sharing_prefix(self, word: str, extra_letters: int) -> bool:
+        """
+        Is there another word that is at most extra_letters shorter or longer and matches all but the last
+        extra_letters letters of the longer of the two words.
+        """
+        num_words = 0
+        length = len(word)
+        # other words up to the same length: the prefix is the word without its last extra_letters letters
+        for other_length in range(max(length - extra_letters, 0), length + 1):
+            num_words += self._count_by_prefix.get((word[:length - extra_letters], other_length), 0)
+        # longer words: the prefix is the other word without its last extra_letters letters
+        for other_length in range(length + 1, length + extra_letters + 1):
+            num_words += self._count_by_prefix.get((word[:other_length - extra_letters], other_length), 0)
+        if word in self._words:
+            num_words -= 1  # the word matches itself
+        return num_words > 0
+
+    def get_neighbors(self, word: str, radius: int = 3) -> List[List[str]]:
+        """
+        :return: the words closest to word in alphabetical order among words with the same first 2 letters,
+        and the words closest to word in order of their reversed spelling among words with the same last 4 letters
+        """
+        by_first_2 = self._by_first_2.get(word[:2], [])
+        i = bisect_left(by_first_2, word)
+        by_last_4 = self._by_last_4.get(word[-4:], [])
+        j = bisect_left(by_last_4, word[::-1])
+        return [by_first_2[max(i - radius, 0):i + radius + 1],
+                [x[::-1] for x in by_last_4[max(j - radius, 0):j + radius + 1]]]
+
+    def get_words_within_edits(self, word: str, max_edits: int) -> List[str]:
+        """
+        Words at most max_edits insertions, deletions or substitutions away from word, with a symmetric delete
+        table: two words are within max_edits edits only if they share a string made by deleting letters from both.
+        """
+        words_by_delete = self._words_by_delete.get(max_edits, None)
+        if words_by_delete is None:
+            words_by_delete = {}
+            for other in self._words:
+                for delete in get_deletes(other, max_edits):
+                    words_by_delete.setdefault(delete, []).append(other)
+            self._words_by_delete[max_edits] = words_by_delete
+
+        candidates = set()
+        for delete in get_deletes(word, max_edits):
+            candidates.update(words_by_delete.get(delete, []))
+        output = [x for x in candidates if get_edit_distance(word, x, max_edits) <= max_edits]
+        output.sort()
+        return output
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, TypedDict
+
+import spacy
+from spacy import Language as SpacyLanguage
+
+from util import language_to_code
+
+# names used by the components of the spacy trained pipelines
+ALL_COMPONENTS = ['tok2vec', 'tagger', 'morphologizer', 'parser', 'senter', 'attribute_ruler', 'lemmatizer', 'ner',
+                  'trainable_lemmatizer', 'entity_ruler']
+
+
+# spacy package sizes. The lg and md tok2vec layers read the static word vectors, so the vectors table can only
+# be dropped from pipelines without a tagger. sm has no vectors: much less memory, slightly different tags and lemmas
+PIPELINE_SIZES = ['lg', 'md', 'sm']
+
+
+class PipelineProfile(TypedDict):
+    keep: Optional[List[str]]  # components to load, None for the whole pipeline
+    needs_sentences: bool  # if True and neither parser nor senter is kept, add a rule based sentencizer
+
+
+PIPELINE_PROFILES: Dict[str, PipelineProfile] = {
+    # everything, like spacy.load
+    'full': PipelineProfile(keep=None, needs_sentences=True),
+    # lemmas, parts of speech and sentences. senter is much cheaper than the dependency parser
+    'count': PipelineProfile(keep=['tok2vec', 'tagger', 'morphologizer', 'attribute_ruler', 'lemmatizer', 'senter'],
+                             needs_sentences=True),
+    # chapter mode needs the same things as counting. Keeping the same components means chapter mode reads
+    # the docs the counters already saved in the DocStore
+    'chapter': PipelineProfile(keep=['tok2vec', 'tagger', 'morphologizer', 'attribute_ruler', 'lemmatizer', 'senter'],
+                               needs_sentences=True),
+    # only token texts are used
+    'emphasis': PipelineProfile(keep=[], needs_sentences=False),
+    # only token texts are used
+    'raw': PipelineProfile(keep=[], needs_sentences=False),
+}
+
+
+_pipeline_size = 'lg'
+
+
+def set_pipeline_size(size: str):
+    """
+    Choose the spacy package size for every pipeline loaded after this. 'sm' is the memory-lean choice.
+    """
+    global _pipeline_size
+    if size not in PIPELINE_SIZES:
+        raise Exception(f"unknown pipeline size {size}, use one of {PIPELINE_SIZES}")
+    _pipeline_size = size
+
+
+def get_pipeline_size() -> str:
+    return _pipeline_size
+
+
+def get_pipeline_name(language: str, size: Optional[str] = None) -> str:
+    if size is None:
+        size = _pipeline_size
+    return language_to_code(language) + "_core_news_" + size
+
+
+# loaded pipelines, least recently used first. Profiles that keep the same components share a pipeline
+_loaded_pipelines: "OrderedDict[Tuple[str, Optional[Tuple[str, ...]], bool], SpacyLanguage]" = OrderedDict()
+_max_loaded_pipelines = 4
+
+
+def set_max_loaded_pipelines(max_loaded: int):
+    """
+    Limit how many pipelines stay in memory. The least recently used pipeline is dropped first.
+    """
+    global _max_loaded_pipelines
+    _max_loaded_pipelines = max_loaded
+    _drop_old_pipelines()
+
+
+def _drop_old_pipelines():
+    while len(_loaded_pipelines) > _max_loaded_pipelines:
+        _loaded_pipelines.popitem(last=False)
+
+
+def get_nlp(language: str, profile: str = 'full') -> SpacyLanguage:
+    """
+    Get the spacy pipeline for a language with only the components a task needs.
+    Pipelines are loaded once per process and shared by every caller.
+    :param language: the language
+    :param profile: one of PIPELINE_PROFILES
+    """
+    pipeline_profile = PIPELINE_PROFILES[profile]
+    keep = pipeline_profile['keep']
+    key = (get_pipeline_name(language), tuple(keep) if keep is not None else None,
+           pipeline_profile['needs_sentences'])
+    if key in _loaded_pipelines:
+        _loaded_pipelines.move_to_end(key)
+        return _loaded_pipelines[key]
+    nlp = load_nlp(language, profile)
+    _loaded_pipelines[key] = nlp
+    _drop_old_pipelines()
+    return nlp
+
+
+def warm_up(language: str, profiles: List[str]):
+    """
+    Load pipelines before they are needed and run them once, so the first real document isn't slow.
+    """
+    for profile in profiles:
+        get_nlp(language, profile)("warm up")
+
+
+def load_nlp(language: str, profile: str = 'full', size: Optional[str] = None) -> SpacyLanguage:
+    """
+    Load a new copy of the spacy pipeline for a profile. Use get_nlp unless you need a private copy.
+    :param language: the language
+    :param profile: one of PIPELINE_PROFILES
+    :param size: one of PIPELINE_SIZES, default is set_pipeline_size
+    """
+    language_code = language_to_code(language)
+    spacy_pipeline = get_pipeline_name(language, size)
+    pipeline_profile = PIPELINE_PROFILES[profile]
+    try:
+        if pipeline_profile['keep'] is None:
+            nlp = spacy.load(spacy_pipeline)
+        else:
+            exclude = [x for x in ALL_COMPONENTS if x not in pipeline_profile['keep']]
+            if len(pipeline_profile['keep']) == 0:
+                # nothing uses the word vectors, which are most of the memory of a lg pipeline
+                exclude.append('vectors')
+            nlp = spacy.load(spacy_pipeline, exclude=exclude)
+            for name in nlp.disabled:
+                if name in pipeline_profile['keep']:
+                    nlp.enable_pipe(name)
+    except ImportError:
+        print(f"could not import spacy pipeline {spacy_pipeline}")
+        print(f"refer to https://spacy.io/models/{language_code}")
+        print(f"you may be install it like this: python -m spacy download {spacy_pipeline}")
+        raise
+
+    if pipeline_profile['needs_sentences'] and ('parser' not in nlp.pipe_names) and ('senter' not in nlp.pipe_names):
+        nlp.add_pipe('sentencizer')
+    return nlp
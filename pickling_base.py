@@ -1,20 +1,75 @@
 from abc import ABC
-from typing import TypeVar, Optional, Type
+from typing import Any, TypeVar, Optional, Type
 import pickle
 import os
 
+import serializers
+
 T = TypeVar('T')
 
+# a journal is compacted into the snapshot once it is bigger than the snapshot and at least this big
+MIN_JOURNAL_COMPACT_BYTES = 1 << 20
+
+
+def _fsync_directory(directory: str):
+    # makes a rename in the directory durable. Windows can't open directories, and doesn't need it
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_atomically(path: str, obj: Any, serializer: str):
+    # a kill or power loss while saving leaves the old file in place, never half a pickle. The data is on disk
+    # before the rename, so the rename can't put an empty file in place of a snapshot that a journal was dropped for
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as file_out:
+        file_out.write(serializers.dumps(obj, serializer))
+        file_out.flush()
+        os.fsync(file_out.fileno())
+    os.replace(temp_path, path)
+    _fsync_directory(os.path.dirname(path))
+
+
+def _read(path: str) -> Any:
+    with open(path, 'rb') as fin:
+        return serializers.loads(fin.read())
+
 
 class PicklingBaseClass(ABC):
+    """
+    Saved as a pickle in cache/<language>/<class name>.pickle.
+    Classes that set use_journal also append each change to a journal (see append_to_journal), which is replayed
+    on load with apply_journal_entry. Changes are then kept as they are made, not when the whole object is saved.
+    save writes a new snapshot and starts a new journal.
+    Files are written with the serializer of the class (see serializers) and read back in whatever format they have.
+    """
+    use_journal = False
+    serializer = 'pickle'
+
     def __init__(self, language: str):
         self.language = language
         self.dirty_count = 0
+        # snapshots and journal entries carry a generation, so a journal left behind by a save that was
+        # interrupted before it removed the journal is not replayed twice
+        self._journal_generation = 0
 
     @staticmethod
     def s_get_cache_path(language: str, klass: Type[T]) -> str:
         return f"./cache/{language}/{klass.__name__}.pickle"
 
+    @staticmethod
+    def s_get_journal_path(language: str, klass: Type[T]) -> str:
+        return PicklingBaseClass.s_get_cache_path(language, klass) + ".journal"
+
+    @staticmethod
+    def s_get_shard_path(language: str, klass: Type[T], shard: str) -> str:
+        return f"./cache/{language}/{klass.__name__}/{shard}.pickle"
+
     @staticmethod
     def s_load(language: str, klass: Type[T]) -> T:
         t_inst = PicklingBaseClass.s_load_if_exists(language, klass)
@@ -26,24 +81,96 @@ class PicklingBaseClass(ABC):
     @staticmethod
     def s_load_if_exists(language: str, klass: Type[T]) -> Optional[T]:
         lang_path = PicklingBaseClass.s_get_cache_path(language, klass)
+        t_inst = None
         try:
             if os.path.exists(lang_path):
-                with open(lang_path, 'rb') as fin:
-                    t_inst = pickle.load(fin)
-                    t_inst.language = language
-                    return t_inst
+                t_inst = _read(lang_path)
+                t_inst.language = language
         except:
             print("error reading", lang_path)
             raise
+        if klass.use_journal and os.path.exists(PicklingBaseClass.s_get_journal_path(language, klass)):
+            if t_inst is None:
+                t_inst = klass(language)
+            t_inst._replay_journal()
+        return t_inst
+
+    @staticmethod
+    def s_load_shard_if_exists(language: str, klass: Type[T], shard: str) -> Optional[T]:
+        """
+        Load one shard (for example the part of a counter that comes from a single book) if it was saved.
+        """
+        shard_path = PicklingBaseClass.s_get_shard_path(language, klass, shard)
+        try:
+            if os.path.exists(shard_path):
+                t_inst = _read(shard_path)
+                t_inst.language = language
+                return t_inst
+        except:
+            print("error reading", shard_path)
+            raise
         return None
 
     def get_cache_path(self) -> str:
         return PicklingBaseClass.s_get_cache_path(self.language, self.__class__)
 
+    def get_journal_path(self) -> str:
+        return PicklingBaseClass.s_get_journal_path(self.language, self.__class__)
+
+    def _get_journal_generation(self) -> int:
+        # caches saved before journals have no generation
+        return self.__dict__.get("_journal_generation", 0)
+
+    def append_to_journal(self, entry: Any):
+        """
+        Keep a change that was just made by appending it to the journal. Replaying the entry with
+        apply_journal_entry must make the same change. The journal is compacted when it gets big.
+        """
+        journal_path = self.get_journal_path()
+        os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+        with open(journal_path, 'ab') as file_out:
+            pickle.dump((self._get_journal_generation(), entry), file_out)
+            file_out.flush()
+            os.fsync(file_out.fileno())
+            journal_size = file_out.tell()
+        cache_path = self.get_cache_path()
+        snapshot_size = os.path.getsize(cache_path) if os.path.exists(cache_path) else 0
+        if journal_size > max(snapshot_size, MIN_JOURNAL_COMPACT_BYTES):
+            self.save()
+
+    def apply_journal_entry(self, entry: Any):
+        raise NotImplementedError(f"{self.__class__.__name__} doesn't use a journal")
+
+    def _replay_journal(self):
+        journal_path = self.get_journal_path()
+        generation = self._get_journal_generation()
+        num_entries = 0
+        with open(journal_path, 'r+b') as fin:
+            while True:
+                position = fin.tell()
+                try:
+                    entry_generation, entry = pickle.load(fin)
+                except EOFError:
+                    break
+                except Exception:
+                    # the run was killed while it appended this entry. Drop it so new entries follow good ones
+                    print("dropping a partly written entry at the end of", journal_path)
+                    fin.truncate(position)
+                    break
+                if entry_generation == generation:
+                    self.apply_journal_entry(entry)
+                    num_entries += 1
+        print("replayed", num_entries, "changes from", journal_path)
+
     def save(self):
         self.dirty_count = 0
-        with open(self.get_cache_path(), 'wb') as file_out:
-            # dump information to that file
-            pickle.dump(self, file_out)
-
+        if self.use_journal:
+            # the new snapshot holds every change in the journal
+            self._journal_generation = self._get_journal_generation() + 1
+        _write_atomically(self.get_cache_path(), self, self.serializer)
+        if self.use_journal and os.path.exists(self.get_journal_path()):
+            os.remove(self.get_journal_path())
 
+    def save_shard(self, shard: str):
+        _write_atomically(PicklingBaseClass.s_get_shard_path(self.language, self.__class__, shard), self,
+                          self.serializer)
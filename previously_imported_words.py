@@ -1,26 +1,54 @@
 import csv
 import os
 import pickle
-from typing import Dict
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
 
 from deluxe_token_counter import DeluxeLemmaHit
 from lemma_lookup import LemmaLookup
 from pickling_base import PicklingBaseClass
+from string_ids import IdCounts, StringTable, get_string_id
 
 from util import get_biggest_word
 
 class PreviouslyImportedWords(PicklingBaseClass):
+    """
+    Words already imported into Anki and their lemmas, as string ids of the lower case text (see string_ids),
+    so they can be matched against counters without comparing strings.
+    Each imported file is appended to the journal as it is added, so an interrupted import keeps the files done.
+    """
+    use_journal = True
+
     def __init__(self, language: str):
-        self._seen_words: Dict[str, bool] = {}
-        self._seen_words_and_lemmas: Dict[str, bool] = {}
+        self._seen_words = StringTable()
+        self._seen_words_and_lemmas = IdCounts()
         self._seen_csv_paths: Dict[str, bool] = {}
         super().__init__(language)
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self._seen_words, dict):
+            # older caches keep dictionaries of text
+            self._seen_words = StringTable(state["_seen_words"].keys())
+            self._seen_words_and_lemmas = IdCounts()
+            for text in state["_seen_words_and_lemmas"]:
+                self._seen_words_and_lemmas.add(get_string_id(text))
+
     def get_all_seen_words(self) -> [str]:
-        return list(self._seen_words.keys())
+        return self._seen_words.get_texts(self._seen_words)
 
     def has_seen_word_or_lemma(self, text: str) -> bool:
-        return text.lower() in self._seen_words_and_lemmas
+        return get_string_id(text.lower()) in self._seen_words_and_lemmas
+
+    def has_seen_ids(self, string_ids: Iterable[int]) -> bool:
+        """
+        :param string_ids: string ids of lower case words or lemmas
+        """
+        return any(x in self._seen_words_and_lemmas for x in string_ids)
+
+    def get_seen_word_or_lemma_ids(self) -> np.ndarray:
+        return self._seen_words_and_lemmas.get_ids()
 
     def has_seen_info(self, info: DeluxeLemmaHit):
         if self.has_seen_word_or_lemma(info['lemma']):
@@ -31,30 +59,62 @@ class PreviouslyImportedWords(PicklingBaseClass):
         return False
 
     def add(self, text: str, lemma_lookup: "LemmaLookup"):
-        self._seen_words[text.lower()] = True
-        self._seen_words_and_lemmas[text.lower()] = True
+        self._seen_words_and_lemmas.add(self._seen_words.add(text.lower()))
         for lemma_info in lemma_lookup.get_lemmas(text):
-            self._seen_words_and_lemmas[get_biggest_word(lemma_info['lemma'].lower())] = True
+            self._seen_words_and_lemmas.add(get_string_id(get_biggest_word(lemma_info['lemma'].lower())))
 
-    def add_file(self, file_path, lemma_lookup: "LemmaLookup"):
+    @staticmethod
+    def read_file(file_path, lemma_lookup: "LemmaLookup") -> Tuple[List[str], List[int]]:
+        """
+        :return: the words of an imported file, and the string ids of their lemmas
+        """
+        words = []
+        lemma_ids = []
         if file_path.endswith('.csv'):
             separator = ','
         elif file_path.endswith('.tsv'):
             separator = '\t'
         else:
-            return
+            return words, lemma_ids
         with open(file_path, mode='r') as fin:
             csv_file = csv.reader(fin, delimiter=separator)
             for row in csv_file:
-                self.add(row[0], lemma_lookup)
+                words.append(row[0])
+                for lemma_info in lemma_lookup.get_lemmas(row[0]):
+                    lemma_ids.append(get_string_id(get_biggest_word(lemma_info['lemma'].lower())))
+        return words, lemma_ids
+
+    def add_file(self, file_path, lemma_lookup: "LemmaLookup"):
+        words, lemma_ids = self.read_file(file_path, lemma_lookup)
+        self.apply_journal_entry((None, words, lemma_ids))
+
+    def apply_journal_entry(self, entry: Tuple[str, List[str], List[int]]):
+        """
+        :param entry: the name of an imported file, its words and the string ids of their lemmas
+        """
+        file, words, lemma_ids = entry
+        for text in words:
+            self._seen_words_and_lemmas.add(self._seen_words.add(text.lower()))
+        for lemma_id in lemma_ids:
+            self._seen_words_and_lemmas.add(lemma_id)
+        if file is not None:
+            self._seen_csv_paths[file] = True
 
     def add_new_files(self, lemma_lookup: "LemmaLookup", save: bool = True):
+        """
+        Add the files in <language>/already_imported that weren't added before.
+        :param save: write a new snapshot when files were added. Without it they are only kept in the journal
+        """
         root_path = os.path.join(self.language, 'already_imported')
+        num_added = 0
         for file in os.listdir(root_path):
             if file not in self._seen_csv_paths:
-                self.add_file(os.path.join(root_path, file), lemma_lookup)
-                self._seen_csv_paths[file] = True
-        if save:
+                words, lemma_ids = self.read_file(os.path.join(root_path, file), lemma_lookup)
+                entry = (file, words, lemma_ids)
+                self.apply_journal_entry(entry)
+                self.append_to_journal(entry)
+                num_added += 1
+        if save and (num_added > 0):
             self.save()
 
     @staticmethod
@@ -1,60 +1,68 @@
-from typing import Dict, Optional
+import os
+from typing import Optional, TYPE_CHECKING
 
-import ebooklib
-from ebooklib import epub
+import numpy as np
 
-from util import is_text_chapter, chapter_to_str
+from ingestion import register_counter, ingest, get_first_occurrences, DOC_ORTH
 from pickling_base import PicklingBaseClass
-from spacy import Language as SpacyLanguage
+from string_ids import IdCounts, get_string_id
 
+if TYPE_CHECKING:
+    from spacy import Language as SpacyLanguage
+    from spacy.tokens import Doc, Token
+
+
+@register_counter
 class RawWordCounter(PicklingBaseClass):
     """
     UNUSED
     Original word counter.
-    Simple boolean dictionary.
+    Simple count of the string ids of the words seen.
     """
     def __init__(self, language: str):
-        self._words_seen: Dict[str, bool] = {}
+        self._words_seen = IdCounts()
         super().__init__(language)
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self._words_seen, dict):
+            # older caches keep a dictionary of words
+            self._words_seen = IdCounts()
+            for word in state["_words_seen"]:
+                self._words_seen.add(get_string_id(word))
+
     def contains_word(self, the_word: str) -> bool:
-        return the_word in self._words_seen
+        return get_string_id(the_word) in self._words_seen
+
+    def count_unique(self) -> int:
+        return len(self._words_seen)
 
     def add(self, the_word: str):
-        self._words_seen[the_word] = True
+        self._words_seen.add(get_string_id(the_word))
+
+    def add_token(self, token: 'Token', book: int, chapter: int):
+        self.add(token.text)
+
+    def add_doc(self, doc: 'Doc', doc_array: np.ndarray, book: int, chapter: int):
+        orth_ids, _, counts = get_first_occurrences(doc_array[:, DOC_ORTH])
+        for orth_id, count in zip(orth_ids.tolist(), counts.tolist()):
+            self._words_seen.add(orth_id, count)
+
+    def merge(self, other: "RawWordCounter", book: Optional[int] = None):
+        self._words_seen.merge(other._words_seen)
+
+    def subtract(self, other: "RawWordCounter", book: Optional[int] = None):
+        self._words_seen.subtract(other._words_seen)
 
     @staticmethod
     def load(language: str) -> Optional["RawWordCounter"]:
         return PicklingBaseClass.s_load_if_exists(language, RawWordCounter)
 
 
-def get_raw_word_count(language: str, books: [str], nlp: SpacyLanguage) -> RawWordCounter:
+def get_raw_word_count(language: str, books: [str], nlp: 'SpacyLanguage') -> RawWordCounter:
     counter = RawWordCounter.load(language)
     if counter is not None:
         return counter
     print("no cache, counting raw the hard way")
-
-    for book_path in books:
-        input_path = f"{language}/{book_path}"
-        book = epub.read_epub(input_path)
-        # items = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
-        all_items = book.get_items_of_type(ebooklib.ITEM_DOCUMENT)
-        chapter_num = 0
-        counter: RawWordCounter = RawWordCounter(language)
-
-        for item in all_items:
-            if is_text_chapter(item, language):
-                chapter_num += 1
-                print(f"chapter {chapter_num} length is {len(item.get_body_content())}")
-                text = chapter_to_str(item)
-                doc = nlp(text)
-                for sent in doc.sents:
-                    for token in sent:
-                        counter.add(token.text)
-                print("counted chapter", chapter_num)
-            else:
-                print("skip chapter", item.get_name())
-
-        counter.save()
-
-    return counter
+    # nlp is no longer used: the tokens come from the shared count pipeline
+    return ingest(language, [RawWordCounter], [os.path.join(language, x) for x in books])[RawWordCounter]
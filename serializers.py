@@ -0,0 +1,132 @@
+"""
+Formats for the cache files written by PicklingBaseClass. loads finds the format from the first bytes of the data,
+so a class can change its serializer and still read the files saved before.
+Serializers are named <encoding> or <encoding>+<compression>:
+    pickle: pickle protocol 5
+    msgpack: the class of the object and its pickle state packed with msgpack. State values msgpack can't encode
+        (numpy arrays, arrays, other objects) are pickled inside it
+    zstd, lz4: the encoded bytes compressed with zstandard or lz4
+msgpack, zstandard and lz4 are optional. Without them, saving falls back to pickle and no compression.
+"""
+import importlib
+import pickle
+from typing import Any, List
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+ENCODINGS = ['pickle', 'msgpack']
+COMPRESSIONS = ['zstd', 'lz4']
+
+_MSGPACK_MAGIC = b'MSGPACK1'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+_LZ4_MAGIC = b'\x04\x22\x4d\x18'
+# msgpack extension types
+_EXT_PICKLED = 1
+_EXT_TUPLE = 2
+
+
+def is_available(serializer: str) -> bool:
+    encoding, _, compression = serializer.partition('+')
+    if (encoding not in ENCODINGS) or (compression not in COMPRESSIONS + ['']):
+        raise ValueError(f"unknown serializer: {serializer}")
+    return ((encoding != 'msgpack') or (msgpack is not None)) and \
+        ((compression != 'zstd') or (zstandard is not None)) and ((compression != 'lz4') or (lz4 is not None))
+
+
+def get_serializers() -> List[str]:
+    """
+    :return: the names of the serializers that can be used here
+    """
+    names = ENCODINGS + [f"{x}+{y}" for x in ENCODINGS for y in COMPRESSIONS]
+    return [x for x in names if is_available(x)]
+
+
+def _pack_default(obj: Any) -> "msgpack.ExtType":
+    # with strict_types, tuples come here too, so they aren't read back as lists
+    if isinstance(obj, tuple):
+        return msgpack.ExtType(_EXT_TUPLE, _packb(list(obj)))
+    return msgpack.ExtType(_EXT_PICKLED, pickle.dumps(obj, protocol=5))
+
+
+def _ext_hook(code: int, data: bytes) -> Any:
+    if code == _EXT_TUPLE:
+        return tuple(_unpackb(data))
+    if code == _EXT_PICKLED:
+        return pickle.loads(data)
+    return msgpack.ExtType(code, data)
+
+
+def _packb(obj: Any) -> bytes:
+    return msgpack.packb(obj, default=_pack_default, strict_types=True, use_bin_type=True)
+
+
+def _unpackb(data: bytes) -> Any:
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+
+
+def _dumps_msgpack(obj: Any) -> bytes:
+    klass = obj.__class__
+    state = obj.__getstate__() if hasattr(obj, '__getstate__') else obj.__dict__
+    return _MSGPACK_MAGIC + _packb([klass.__module__, klass.__qualname__, state])
+
+
+def _loads_msgpack(data: bytes) -> Any:
+    module, qualname, state = _unpackb(data[len(_MSGPACK_MAGIC):])
+    klass = importlib.import_module(module)
+    for name in qualname.split('.'):
+        klass = getattr(klass, name)
+    obj = klass.__new__(klass)
+    if hasattr(obj, '__setstate__'):
+        obj.__setstate__(state)
+    else:
+        obj.__dict__.update(state)
+    return obj
+
+
+def dumps(obj: Any, serializer: str = 'pickle') -> bytes:
+    """
+    :param obj: the object to save. msgpack needs an object whose class can be imported, like pickle does
+    :param serializer: see get_serializers
+    """
+    encoding, _, compression = serializer.partition('+')
+    if not is_available(encoding):
+        encoding = 'pickle'
+    if encoding == 'msgpack':
+        data = _dumps_msgpack(obj)
+    else:
+        data = pickle.dumps(obj, protocol=5)
+    if (compression == 'zstd') and (zstandard is not None):
+        data = zstandard.ZstdCompressor().compress(data)
+    elif (compression == 'lz4') and (lz4 is not None):
+        data = lz4.frame.compress(data)
+    return data
+
+
+def loads(data: bytes) -> Any:
+    """
+    Read data saved by dumps with any serializer, or by pickle.
+    """
+    if data.startswith(_ZSTD_MAGIC):
+        if zstandard is None:
+            raise ImportError("reading a zstd compressed cache needs zstandard: pip install zstandard")
+        return loads(zstandard.ZstdDecompressor().decompress(data))
+    if data.startswith(_LZ4_MAGIC):
+        if lz4 is None:
+            raise ImportError("reading an lz4 compressed cache needs lz4: pip install lz4")
+        return loads(lz4.frame.decompress(data))
+    if data.startswith(_MSGPACK_MAGIC):
+        if msgpack is None:
+            raise ImportError("reading a msgpack cache needs msgpack: pip install msgpack")
+        return _loads_msgpack(data)
+    return pickle.loads(data)
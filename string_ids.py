@@ -0,0 +1,295 @@
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+_MASK = (1 << 64) - 1
+_M = 0xc6a4a7935bd1e995
+_R = 47
+
+
+@lru_cache(maxsize=1 << 16)
+def get_string_id(text: str) -> int:
+    """
+    The 64 bit id spacy gives a string (spacy.strings.hash_string), without importing spacy.
+    Ids in Doc arrays (ORTH, LOWER, LEMMA) can be used as keys with no conversion.
+    This is MurmurHash64A of the utf-8 bytes with seed 1, like spacy.
+    """
+    data = text.encode('utf8')
+    length = len(data)
+    h = 1 ^ ((length * _M) & _MASK)
+    end = length - length % 8
+    for i in range(0, end, 8):
+        k = (int.from_bytes(data[i:i + 8], 'little') * _M) & _MASK
+        k ^= k >> _R
+        k = (k * _M) & _MASK
+        h ^= k
+        h = (h * _M) & _MASK
+    if end < length:
+        h ^= int.from_bytes(data[end:], 'little')
+        h = (h * _M) & _MASK
+    h ^= h >> _R
+    h = (h * _M) & _MASK
+    h ^= h >> _R
+    return h
+
+
+def _find(ids: np.ndarray, string_id: int) -> int:
+    """
+    :return: the index of string_id in the sorted id array ids, or -1
+    """
+    string_id = np.uint64(string_id)  # mixing python ints and uint64 makes floats in older numpy
+    i = int(np.searchsorted(ids, string_id))
+    return i if (i < len(ids)) and (ids[i] == string_id) else -1
+
+
+class StringTable:
+    """
+    Id -> text for the strings a counter keys on, so counters can key on ids and only turn them back into text
+    for output.
+    The table is a sorted id array, one string with every text and the offset of each text in it.
+    Texts added since the table was last read are kept in a dict and moved into the arrays on the next read.
+    """
+    def __init__(self, texts: Iterable[str] = ()):
+        self._ids = np.zeros(0, dtype=np.uint64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._text = ""
+        self._pending: Dict[int, str] = {}
+        for text in texts:
+            self.add(text)
+
+    def __getstate__(self):
+        self._flush()
+        return {"ids": self._ids, "offsets": self._offsets, "text": self._text}
+
+    def __setstate__(self, state):
+        self._ids = state["ids"]
+        self._offsets = state["offsets"]
+        self._text = state["text"]
+        self._pending = {}
+
+    def __len__(self) -> int:
+        self._flush()
+        return len(self._ids)
+
+    def __contains__(self, string_id: int) -> bool:
+        return (string_id in self._pending) or (_find(self._ids, string_id) >= 0)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.get_ids().tolist())
+
+    def _flush(self):
+        if len(self._pending) == 0:
+            return
+        ids = np.concatenate([self._ids, np.fromiter(self._pending.keys(), dtype=np.uint64, count=len(self._pending))])
+        texts = self._get_all_texts() + list(self._pending.values())
+        order = np.argsort(ids, kind='stable')
+        self._ids = ids[order]
+        texts = [texts[x] for x in order.tolist()]
+        self._offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in texts], out=self._offsets[1:])
+        self._text = "".join(texts)
+        self._pending = {}
+
+    def _get_all_texts(self) -> List[str]:
+        offsets = self._offsets.tolist()
+        return [self._text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+    def add(self, text: str, string_id: Optional[int] = None) -> int:
+        """
+        :param text: the text to add
+        :param string_id: the id of the text, if the caller already knows it
+        :return: the id of the text
+        """
+        if string_id is None:
+            string_id = get_string_id(text)
+        if string_id not in self:
+            self._pending[string_id] = text
+        return string_id
+
+    def get_text(self, string_id: int) -> str:
+        text = self._pending.get(string_id, None)
+        if text is not None:
+            return text
+        i = _find(self._ids, string_id)
+        if i < 0:
+            raise KeyError(string_id)
+        return self._text[self._offsets[i]:self._offsets[i + 1]]
+
+    def get_texts(self, string_ids: Iterable[int]) -> List[str]:
+        self._flush()
+        ids = np.fromiter(string_ids, dtype=np.uint64)
+        indexes = np.searchsorted(self._ids, ids)
+        missing = indexes >= len(self._ids)
+        missing[~missing] = self._ids[indexes[~missing]] != ids[~missing]
+        if missing.any():
+            raise KeyError(int(ids[np.argmax(missing)]))
+        indexes = indexes.tolist()
+        offsets = self._offsets.tolist()
+        return [self._text[offsets[i]:offsets[i + 1]] for i in indexes]
+
+    def update(self, other: "StringTable"):
+        other._flush()
+        for string_id, text in zip(other._ids.tolist(), other._get_all_texts()):
+            self.add(text, string_id)
+
+    def get_ids(self) -> np.ndarray:
+        """
+        :return: every id in the table, sorted
+        """
+        self._flush()
+        return self._ids
+
+
+class IdCounts:
+    """
+    Counts keyed on string ids, as a sorted id array and a count array.
+    Counts added since the arrays were last read are kept in a dict and moved into the arrays on the next read,
+    so counting is a dict update and a loaded counter holds two arrays.
+    """
+    def __init__(self):
+        self._ids = np.zeros(0, dtype=np.uint64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._pending: Dict[int, int] = {}
+
+    def __getstate__(self):
+        self._flush()
+        return {"ids": self._ids, "counts": self._counts}
+
+    def __setstate__(self, state):
+        self._ids = state["ids"]
+        self._counts = state["counts"]
+        self._pending = {}
+
+    def __len__(self) -> int:
+        self._flush()
+        return len(self._ids)
+
+    def __contains__(self, string_id: int) -> bool:
+        return (string_id in self._pending) or (_find(self._ids, string_id) >= 0)
+
+    def _add_arrays(self, ids: np.ndarray, counts: np.ndarray):
+        ids, inverse = np.unique(np.concatenate([self._ids, ids]), return_inverse=True)
+        self._counts = np.bincount(inverse.reshape(-1), weights=np.concatenate([self._counts, counts]),
+                                   minlength=len(ids)).astype(np.int64)
+        self._ids = ids
+
+    def _flush(self):
+        if len(self._pending) == 0:
+            return
+        pending = self._pending
+        self._pending = {}
+        self._add_arrays(np.fromiter(pending.keys(), dtype=np.uint64, count=len(pending)),
+                         np.fromiter(pending.values(), dtype=np.int64, count=len(pending)))
+
+    def add(self, string_id: int, count: int = 1):
+        self._pending[string_id] = self._pending.get(string_id, 0) + count
+
+    def get(self, string_id: int) -> int:
+        """
+        :return: the count of an id, 0 if it was never counted
+        """
+        count = self._pending.get(string_id, 0)
+        i = _find(self._ids, string_id)
+        return count if i < 0 else count + int(self._counts[i])
+
+    def merge(self, other: "IdCounts"):
+        other._flush()
+        self._flush()
+        self._add_arrays(other._ids, other._counts)
+
+    def subtract(self, other: "IdCounts"):
+        """
+        Take away the counts of another IdCounts. Ids left with no count are dropped.
+        """
+        other._flush()
+        self._flush()
+        self._add_arrays(other._ids, -other._counts)
+        kept = self._counts > 0
+        self._ids = self._ids[kept]
+        self._counts = self._counts[kept]
+
+    def get_ids(self) -> np.ndarray:
+        """
+        :return: every id counted, sorted
+        """
+        self._flush()
+        return self._ids
+
+    def get_counts(self) -> np.ndarray:
+        """
+        :return: the counts, in the order of get_ids
+        """
+        self._flush()
+        return self._counts
+
+
+class IdTupleCounts:
+    """
+    Counts keyed on tuples of string ids, like IdCounts, as a 2d id array with one sorted row per key and a count
+    array.
+    """
+    def __init__(self, width: int):
+        self._ids = np.zeros((0, width), dtype=np.uint64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._pending: Dict[Tuple[int, ...], int] = {}
+
+    def __getstate__(self):
+        self._flush()
+        return {"ids": self._ids, "counts": self._counts}
+
+    def __setstate__(self, state):
+        self._ids = state["ids"]
+        self._counts = state["counts"]
+        self._pending = {}
+
+    def __len__(self) -> int:
+        self._flush()
+        return len(self._ids)
+
+    def _add_arrays(self, ids: np.ndarray, counts: np.ndarray):
+        ids, inverse = np.unique(np.concatenate([self._ids, ids]), axis=0, return_inverse=True)
+        self._counts = np.bincount(inverse.reshape(-1), weights=np.concatenate([self._counts, counts]),
+                                   minlength=len(ids)).astype(np.int64)
+        self._ids = ids
+
+    def _flush(self):
+        if len(self._pending) == 0:
+            return
+        pending = self._pending
+        self._pending = {}
+        self._add_arrays(np.array(list(pending.keys()), dtype=np.uint64).reshape(-1, self._ids.shape[1]),
+                         np.fromiter(pending.values(), dtype=np.int64, count=len(pending)))
+
+    def add(self, key: Tuple[int, ...], count: int = 1):
+        self._pending[key] = self._pending.get(key, 0) + count
+
+    def merge(self, other: "IdTupleCounts"):
+        other._flush()
+        self._flush()
+        self._add_arrays(other._ids, other._counts)
+
+    def subtract(self, other: "IdTupleCounts"):
+        """
+        Take away the counts of another IdTupleCounts. Keys left with no count are dropped.
+        """
+        other._flush()
+        self._flush()
+        self._add_arrays(other._ids, -other._counts)
+        kept = self._counts > 0
+        self._ids = self._ids[kept]
+        self._counts = self._counts[kept]
+
+    def get_ids(self) -> np.ndarray:
+        """
+        :return: every key counted, one row per key, sorted
+        """
+        self._flush()
+        return self._ids
+
+    def get_counts(self) -> np.ndarray:
+        """
+        :return: the counts, in the order of get_ids
+        """
+        self._flush()
+        return self._counts
@@ -0,0 +1,26 @@
+import os
+import pickle
+
+from wiktionary_cache import WiktionaryCache
+from pickling_base import PicklingBaseClass
+
+
+def test_migrate_pickled_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # the format WiktionaryCache was pickled in before it moved to sqlite: dicts in its __dict__, no parser
+    old = WiktionaryCache.__new__(WiktionaryCache)
+    old.__dict__.update({'language': 'spanish', 'lang_code': 'es', 'dirty_count': 0,
+                         'definitions': {'casa': [{'definitions': [], 'etymology': 'From Latin casa'}]},
+                         'sources': {'casa': {'book 1'}},
+                         'wiktionary_cache': {'casa:spanish': {'word_data': [], 'links': []}}})
+    pickle_path = PicklingBaseClass.s_get_cache_path('spanish', WiktionaryCache)
+    os.makedirs(os.path.dirname(pickle_path))
+    with open(pickle_path, 'wb') as fout:
+        pickle.dump(old, fout)
+
+    cache = WiktionaryCache.load('spanish')
+    assert cache.definitions['casa'] == [{'definitions': [], 'etymology': 'From Latin casa'}]
+    assert cache.sources['casa'] == {'book 1'}
+    assert cache.wiktionary_cache['casa:spanish'] == {'word_data': [], 'links': []}
+    assert not os.path.exists(pickle_path)
+    assert os.path.exists(pickle_path + ".migrated")
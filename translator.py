@@ -1,3 +1,4 @@
+from key_value_store import KeyValueStore, get_store_path, migrate_pickle
 from pickling_base import PicklingBaseClass
 from typing import Callable, Protocol, Iterator, Optional, Union, Tuple, Any, overload, Dict, List
 
@@ -31,32 +32,33 @@ def get_deepl_trans(language: str) -> DeeplTranslator2:
     return _translator_engines[key]
 
 
-# translations are saved in cache/<language>/Translation.pickle
+# translations are saved in cache/<language>/Translation.sqlite, one row per translation.
+# Older caches in Translation.pickle are moved there when loaded
 class Translation(PicklingBaseClass):
     def __init__(self, language: str, data: Optional[dict] = None):
-        if data is not None:
-            self.data = data
-        else:
-            self.data = {}
         super().__init__(language)
+        self.data = KeyValueStore(get_store_path(language, 'Translation'), 'translations')
+        if data is not None:
+            self.data.set_many(data.items())
+
+    def save(self):
+        # each translation is written to the store when it is made
+        self.dirty_count = 0
 
     def _translate(self, text: str, key_prefix: str, trans: BaseTranslator, return_all: bool) -> str:
         # print("translate", language, text, key_prefix, return_all)
         key = key_prefix + text
-        if key not in self.data:
+        translation = self.data.get(key, None)
+        if translation is None:
             print("<p>translate", text, "</p>")
             # print("calling translate with ", text)
-            self.data[key] = trans.translate(text, return_all=return_all)
-            if self.data[key] is None:
-                self.data[key] = text
+            translation = trans.translate(text, return_all=return_all)
+            if translation is None:
+                translation = text
             else:
-                print("<p>", self.data[key], "</p>")
-            self.dirty_count += 1
-
-        if self.dirty_count >= 5:
-            self.save()
-
-        return self.data[key]
+                print("<p>", translation, "</p>")
+            self.data[key] = translation
+        return translation
 
     def translate(self, text: str) -> str:
         # use deepl as the default translation engine
@@ -73,7 +75,10 @@ class Translation(PicklingBaseClass):
 
     @staticmethod
     def load(language: str) -> "Translation":
-        return PicklingBaseClass.s_load(language, Translation)
+        trans = Translation(language)
+        migrate_pickle(PicklingBaseClass.s_get_cache_path(language, Translation),
+                       lambda old: trans.data.set_many(old.data.items()))
+        return trans
 
 
 if __name__ == '__main__':
@@ -1,7 +1,11 @@
+import hashlib
 import os
-from typing import List
+from typing import List, Optional
 
-from bs4 import BeautifulSoup
+from key_value_store import KeyValueStore
+
+# chapters shorter than this are title pages, tables of contents, etc.
+MIN_TEXT_CHAPTER_LENGTH = 14000
 
 
 def language_to_code(language: str) -> str:
@@ -39,13 +43,15 @@ def is_text_chapter(item, language: str):
     This function returns true for any chapter with at least 14,000 characters.
     This is very crude but it worked for me.
     """
-    if len(item.get_body_content()) < 14000:
+    if len(item.get_body_content()) < MIN_TEXT_CHAPTER_LENGTH:
         return False
     return True
 
 
 def chapter_to_str(chapter) -> str:
-    soup = BeautifulSoup(chapter.get_body_content(), "html.parser")
+    # imported here, so commands that only read the caches don't load bs4
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(chapter.get_body_content(), "lxml")
     text = [para.get_text() for para in soup.find_all("p")]
     return " ".join(text)
 
@@ -92,6 +98,36 @@ def get_books(language: str) -> List[str]:
     return output
 
 
+# absolute path of a book -> (size, mtime in ns, hash), opened by get_book_hash
+_book_hash_store: Optional[KeyValueStore] = None
+
+
+def get_book_hash(input_path: str) -> str:
+    """
+    Hash of the epub file contents. Caches are keyed by this, so renaming a book doesn't recount it.
+    Hashes are kept in cache/book_hashes.sqlite with the size and modification time of the file, and a book is
+    only hashed again when those change.
+    """
+    global _book_hash_store
+    if _book_hash_store is None:
+        _book_hash_store = KeyValueStore("./cache/book_hashes.sqlite", 'book_hashes')
+    key = os.path.abspath(input_path)
+    stat = os.stat(input_path)
+    cached = _book_hash_store.get(key, None)
+    if (cached is not None) and (cached[0] == stat.st_size) and (cached[1] == stat.st_mtime_ns):
+        return cached[2]
+    sha = hashlib.sha256()
+    with open(input_path, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            sha.update(block)
+    _book_hash_store[key] = (stat.st_size, stat.st_mtime_ns, sha.hexdigest())
+    return sha.hexdigest()
+
+
+def get_text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
 def get_biggest_word(sentence):
     words = sentence.split(' ')
     if len(words) < 2:
@@ -1,22 +1,60 @@
 import os
 import pickle
-from typing import Optional
+from typing import TypedDict, Dict, List, Optional, Tuple, TYPE_CHECKING
 
-import ebooklib
-import spacy
-from ebooklib import epub
+import numpy as np
 
-from spacy.tokens import Token
-
-from lemma_lookup import LemmaLookup
-from util import language_to_code, is_text_chapter, chapter_to_str, unpersonal_parts
+from ingestion import register_counter, ingest, get_first_occurrences, get_doc_string, DOC_LOWER, DOC_POS, \
+    DOC_IS_ALPHA, DOC_LOWER_LEMMA, DOC_MORPH
 from pickling_base import PicklingBaseClass
+from string_ids import IdCounts, IdTupleCounts, StringTable, get_string_id
+
+if TYPE_CHECKING:
+    from spacy.tokens import Doc, Token
+
+# morphology features that depend on the subject. They are left out of the parts of a verb form
+PERSONAL_FEATURES = {'Person', 'Number', 'Gender'}
+
+
+def get_unpersonal_morph(morph: str) -> str:
+    """
+    :param morph: spacy morphology, like "Mood=Ind|Number=Sing|Person=3|Tense=Pres|VerbForm=Fin"
+    :return: the features that don't depend on the subject, like "Mood=Ind|Tense=Pres|VerbForm=Fin", or "_"
+    """
+    features = [x for x in morph.split('|') if (x != '_') and (x.split('=')[0] not in PERSONAL_FEATURES)]
+    return '|'.join(features) if len(features) > 0 else '_'
+
+
+class VerbUsage(TypedDict):
+    parts: str
+    lemma: str  # empty unless grouped by lemma
+    forms: int  # number of verb forms
+    hits: int
+    top_form: str  # the form with the most hits
+    top_form_hits: int
 
 
+@register_counter
 class VerbCounter(PicklingBaseClass):
+    """
+    Hits and first (chapter, sentence) of every verb form, keyed on string ids of the lower case text.
+    The first context is the earliest by (book, chapter, position of the token in the chapter), so counters of any
+    parts of the text can be merged in any order.
+    Hits are also counted by the lemma and morphology spacy gave the form, so verb parts can be tallied without
+    looking anything up, see get_usage_by_parts.
+    """
+    # a third of the size with zstd, for a few more ms to save
+    serializer = 'pickle+zstd'
+
     def __init__(self, language: str):
-        self._hits_by_word = {}
-        self._first_context_by_word = {}
+        self._hits_by_word = IdCounts()
+        self._first_context_by_word: Dict[int, Tuple[int, str]] = {}
+        # (book, chapter, position) of each first context
+        self._first_hit_by_word: Dict[int, Tuple[int, int, int]] = {}
+        # hits of each (form, lower case lemma, morphology), as string ids
+        self._analyses = IdTupleCounts(3)
+        # texts of the forms, lemmas and morphologies
+        self._words = StringTable()
         super().__init__(language)
 
     def __getstate__(self):
@@ -27,19 +65,206 @@ class VerbCounter(PicklingBaseClass):
 
     def __setstate__(self, state):
         self.__dict__.update(state)
+        if "_words" not in state:
+            # older caches key on the text
+            self._words = StringTable(state["_hits_by_word"].keys())
+            self._hits_by_word = IdCounts()
+            for word, hits in state["_hits_by_word"].items():
+                self._hits_by_word.add(get_string_id(word), hits)
+            self._first_context_by_word = {get_string_id(k): v for k, v in state["_first_context_by_word"].items()}
+        if "_first_hit_by_word" not in state:
+            # older caches add words in reading order and don't know the book
+            self._first_hit_by_word = {k: (0, v[0], i) for i, (k, v) in enumerate(self._first_context_by_word.items())}
+        if "_analyses" not in state:
+            # older caches have no lemmas or morphology, dump_verbs asks for a recount
+            self._analyses = IdTupleCounts(3)
         # Add baz back since it doesn't exist in the pickle
         # self._nearby_word_info = None
 
-    def add(self, token: Token, chapter: int):
+    def add(self, token: 'Token', chapter: int, book: int = 1):
+        """
+        Count one token. Tokens of a chapter must be added in order.
+        """
         if not token.is_alpha:
             return
-        key = token.text.lower()
         if (token.pos_ == 'VERB') or (token.pos_ == 'AUX'):
-            if key not in self._hits_by_word:
-                self._hits_by_word[key] = 1
+            key = get_string_id(token.text.lower())
+            if key not in self._first_context_by_word:
                 self._first_context_by_word[key] = (chapter, str(token.sent))
-            else:
-                self._hits_by_word[key] += 1
+                self._first_hit_by_word[key] = (book, chapter, token.i)
+                self._words.add(token.text.lower(), key)
+            self._hits_by_word.add(key)
+            # the text of an empty morphology is "_", like in get_doc_array
+            self._analyses.add((key, self._words.add(token.lemma_.lower()),
+                                self._words.add(token.vocab.strings[token.morph.key])))
+
+    def add_token(self, token: 'Token', book: int, chapter: int):
+        self.add(token, chapter, book)
+
+    def add_doc(self, doc: 'Doc', doc_array: np.ndarray, book: int, chapter: int):
+        """
+        Same as add for every token of a doc, with the hits counted by numpy.
+        """
+        from spacy.parts_of_speech import AUX, VERB
+
+        indexes = np.flatnonzero((doc_array[:, DOC_IS_ALPHA] == 1) & np.isin(doc_array[:, DOC_POS], [VERB, AUX]))
+        keys, firsts, counts = get_first_occurrences(doc_array[indexes, DOC_LOWER])
+        for key, first, count in zip(keys.tolist(), firsts.tolist(), counts.tolist()):
+            if key not in self._first_context_by_word:
+                position = int(indexes[first])
+                self._first_context_by_word[key] = (chapter, str(doc[position].sent))
+                self._first_hit_by_word[key] = (book, chapter, position)
+                self._words.add(get_doc_string(doc, key), key)
+            self._hits_by_word.add(key, count)
+
+        analyses, _, counts = get_first_occurrences(doc_array[indexes][:, [DOC_LOWER, DOC_LOWER_LEMMA, DOC_MORPH]])
+        for (key, lemma_id, morph_id), count in zip(analyses.tolist(), counts.tolist()):
+            for string_id in (lemma_id, morph_id):
+                if string_id not in self._words:
+                    self._words.add(get_doc_string(doc, string_id), string_id)
+            self._analyses.add((key, lemma_id, morph_id), count)
+
+    def _merge_first_hits(self, other: "VerbCounter", keys: List[int], book: Optional[int]):
+        for key in keys:
+            other_book, chapter, position = other._first_hit_by_word[key]
+            first_hit = (other_book if book is None else book, chapter, position)
+            if (key not in self._first_hit_by_word) or (first_hit < self._first_hit_by_word[key]):
+                self._first_hit_by_word[key] = first_hit
+                self._first_context_by_word[key] = other._first_context_by_word[key]
+
+    def merge(self, other: "VerbCounter", book: Optional[int] = None):
+        """
+        Add the counts of another counter to this one.
+        Counters of any parts of the text can be merged in any order, the earliest first contexts win.
+        :param other: the counter to add
+        :param book: if set, first contexts of the other counter are moved to this book number
+        """
+        self._hits_by_word.merge(other._hits_by_word)
+        self._analyses.merge(other._analyses)
+        self._merge_first_hits(other, list(other._first_hit_by_word.keys()), book)
+        self._words.update(other._words)
+
+    def subtract(self, other: "VerbCounter", book: int) -> List[int]:
+        """
+        Remove the counts of one book, given the counter of that book.
+        Words that are left with no hits are removed.
+        :param other: the counter of the book to remove
+        :param book: the book number of that book in this counter
+        :return: string ids of words that still have hits but had their first context in the removed book.
+        Call refill_first_hits for these.
+        """
+        self._hits_by_word.subtract(other._hits_by_word)
+        self._analyses.subtract(other._analyses)
+        stale_keys = []
+        for key in other._first_hit_by_word.keys():
+            if key not in self._first_hit_by_word:
+                continue
+            if key not in self._hits_by_word:
+                del self._first_hit_by_word[key]
+                del self._first_context_by_word[key]
+            elif self._first_hit_by_word[key][0] == book:
+                stale_keys.append(key)
+        return stale_keys
+
+    def refill_first_hits(self, keys: List[int], book_counters: List[Tuple[int, "VerbCounter"]]):
+        """
+        Rebuild the first contexts of some words from per-book counters. Hits are kept as they are.
+        :param keys: string ids of the words to rebuild
+        :param book_counters: (book number, counter for that book) for every book
+        """
+        for key in keys:
+            del self._first_hit_by_word[key]
+            del self._first_context_by_word[key]
+        for book, book_counter in book_counters:
+            self._merge_first_hits(book_counter, [x for x in keys if x in book_counter._first_hit_by_word], book)
+
+    def get_hits_by_word(self) -> Dict[str, int]:
+        ids = self._hits_by_word.get_ids()
+        return dict(zip(self._words.get_texts(ids.tolist()), self._hits_by_word.get_counts().tolist()))
+
+    def get_first_context(self, word: str) -> Optional[Tuple[int, str]]:
+        """
+        :return: (chapter, sentence) where the word was first seen
+        """
+        return self._first_context_by_word.get(get_string_id(word.lower()), None)
+
+    def count_analyses(self) -> int:
+        """
+        :return: number of distinct (form, lemma, morphology)
+        """
+        return len(self._analyses)
+
+    def _get_sorted_analyses(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: (form, lemma, morphology) rows and their hits, most hits first within each form,
+        and the index of the first row of each form
+        """
+        ids = self._analyses.get_ids()
+        counts = self._analyses.get_counts()
+        order = np.lexsort((-counts, ids[:, 0]))
+        ids, counts = ids[order], counts[order]
+        _, firsts = np.unique(ids[:, 0], return_index=True)
+        return ids, counts, firsts
+
+    def get_ambiguous_forms(self) -> List[str]:
+        """
+        :return: verb forms spacy gave more than one lemma
+        """
+        form_lemmas = np.unique(self._analyses.get_ids()[:, :2], axis=0)
+        forms, num_lemmas = np.unique(form_lemmas[:, 0], return_counts=True)
+        return self._words.get_texts(forms[num_lemmas > 1].tolist())
+
+    def get_form_analyses(self, preferred_lemmas: Optional[Dict[str, List[str]]] = None
+                          ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The lemma and morphology spacy gave each verb form most often.
+        :param preferred_lemmas: lemmas to pick for some forms, like the Wiktionary lemmas of a form. The most
+        common analysis with one of these lemmas is used, if there is one.
+        :return: string ids of the forms, their lemmas and their morphologies, and the hits of each form
+        """
+        ids, counts, firsts = self._get_sorted_analyses()
+        hits = np.add.reduceat(counts, firsts) if len(firsts) > 0 else np.zeros(0, dtype=np.int64)
+        chosen = firsts.copy()
+        ends = np.append(firsts[1:], len(ids))
+        for form, lemmas in (preferred_lemmas or {}).items():
+            i = int(np.searchsorted(ids[firsts, 0], np.uint64(get_string_id(form.lower()))))
+            if (i >= len(firsts)) or (int(ids[firsts[i], 0]) != get_string_id(form.lower())):
+                continue
+            lemma_ids = np.array([get_string_id(x.lower()) for x in lemmas], dtype=np.uint64)
+            matches = np.flatnonzero(np.isin(ids[firsts[i]:ends[i], 1], lemma_ids))
+            if len(matches) > 0:
+                chosen[i] = firsts[i] + matches[0]
+        return ids[chosen, 0], ids[chosen, 1], ids[chosen, 2], hits
+
+    def get_usage_by_parts(self, with_lemma: bool, preferred_lemmas: Optional[Dict[str, List[str]]] = None
+                           ) -> List[VerbUsage]:
+        """
+        Verb forms grouped by their parts (morphology without the person, see get_unpersonal_morph), and by
+        lemma if with_lemma is set. Each form is counted once, with the analysis from get_form_analyses.
+        :return: the groups, most forms first
+        """
+        forms, lemmas, morphs, hits = self.get_form_analyses(preferred_lemmas)
+        if len(forms) == 0:
+            return []
+        unique_morphs, morph_inverse = np.unique(morphs, return_inverse=True)
+        parts = [get_unpersonal_morph(x) for x in self._words.get_texts(unique_morphs.tolist())]
+        unique_parts, parts_inverse = np.unique(np.array(parts, dtype=object), return_inverse=True)
+        part_ids = parts_inverse.reshape(-1)[morph_inverse.reshape(-1)].astype(np.uint64)
+        keys = np.column_stack([part_ids, lemmas if with_lemma else np.zeros(len(forms), dtype=np.uint64)])
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        num_forms = np.bincount(inverse, minlength=len(groups))
+        group_hits = np.bincount(inverse, weights=hits, minlength=len(groups)).astype(np.int64)
+        # the most common form of each group is the first of the group after sorting by hits
+        order = np.lexsort((-hits, inverse))
+        top_forms = order[np.unique(inverse[order], return_index=True)[1]]
+        lemma_texts = self._words.get_texts(lemmas[top_forms].tolist()) if with_lemma else [""] * len(groups)
+        top_texts = self._words.get_texts(forms[top_forms].tolist())
+        output = [VerbUsage(parts=unique_parts[int(groups[i, 0])], lemma=lemma_texts[i], forms=int(num_forms[i]),
+                            hits=int(group_hits[i]), top_form=top_texts[i], top_form_hits=int(hits[top_forms[i]]))
+                  for i in range(len(groups))]
+        output.sort(key=lambda x: (-x['forms'], -x['hits']))
+        return output
 
     @staticmethod
     def load(language: str) -> Optional["VerbCounter"]:
@@ -52,92 +277,79 @@ def get_verb_count(language: str, books: [str]) -> VerbCounter:
     if counter is not None:
         return counter
     print("no cache, counting the hard way")
+    return ingest(language, [VerbCounter], [os.path.join(language, x) for x in books])[VerbCounter]
 
-    nlp = spacy.load(language_to_code(language) + "_core_news_lg")
 
-    for book_path in books:
-        input_path = f"{language}/{book_path}"
-        book = epub.read_epub(input_path)
-        # items = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
-        all_items = book.get_items_of_type(ebooklib.ITEM_DOCUMENT)
-        chapter_num = 0
-        counter = VerbCounter(language)
+def dump_verbs(language: str, books: [str], use_wiktionary: bool = False):
+    """
+    Show the most common verb parts, and verb lemmas with their parts, from the morphology spacy gave each form.
+    Each verb form counts once, with the context of the most common form.
+    :param language: the language
+    :param books: the books, relative to the language directory
+    :param use_wiktionary: look up the lemma of forms spacy gave more than one lemma in Wiktionary
+    """
+    counter = get_verb_count(language, books)
+    if counter.count_analyses() == 0:
+        raise Exception(f"the verb count has no morphology, delete cache/{language}/VerbCounter.pickle and "
+                        f"cache/{language}/VerbCounter to count again")
 
-        for item in all_items:
-            if is_text_chapter(item, language):
-                chapter_num += 1
-                print(f"chapter {chapter_num} length is {len(item.get_body_content())}")
-                text = chapter_to_str(item)
-                doc = nlp(text)
-                for sent in doc.sents:
-                    for token in sent:
-                        counter.add(token, chapter_num)
-                print("counted chapter", chapter_num)
-            else:
-                print("skip chapter", item.get_name())
+    preferred_lemmas = {}
+    if use_wiktionary:
+        from lemma_lookup import LemmaLookup
 
-        counter.save()
+        lemma_lookup = LemmaLookup.load(language)
+        ambiguous_forms = counter.get_ambiguous_forms()
+        print("looking up", len(ambiguous_forms), "verb forms in Wiktionary")
+        for form in ambiguous_forms:
+            preferred_lemmas[form] = [x['lemma'] for x in lemma_lookup.get_lemmas(form) if x['type'] == 'verb']
+        lemma_lookup.save()
 
-    return counter
+    for title, with_lemma, max_entries in [("top usage by parts", False, 1000),
+                                           ("top usage by parts and lemma", True, 100)]:
+        uses = HitCounter()
+        for usage in counter.get_usage_by_parts(with_lemma, preferred_lemmas):
+            wd = usage['top_form']
+            chapt, sent = counter.get_first_context(wd)
+            key = f"{usage['lemma']}:{usage['parts']}" if with_lemma else usage['parts']
+            uses.add_hit(key, f"{wd}:{usage['top_form_hits']}/{chapt}: {sent}", hits=usage['forms'])
+        print(title)
+        uses.dump(max_entries)
 
 
-def dump_verbs(language: str, books: [str]):
+class HitCounter:
     """
-    Show information about verbs in the text
-    :param language:
-    :param books:
-    :return:
+    Hits and first context of each key. When hits are added with an order, like (book, chapter, position),
+    the first context is the one with the lowest order, otherwise it is the first one added.
     """
-    lemma_lookup = LemmaLookup.load(language)
-
-    counter = get_verb_count(language, books)
-    top_verbs = [(x, y) for x, y in counter._hits_by_word.items()]
-    top_verbs.sort(key=lambda x: -x[1])
-    # test_cases = [0, 1, 2, 3, 4, 10, 50]
-    # 22 69 1 vamos: Vamos, uno era incluso mayor que él, ¡y vestía una capa verde esmeralda! ¡Qué valor!
-    # for i in [121, 146, 254, 265]: # range(0, 1000):
-
-    uses_by_parts = HitCounter()
-    uses_by_lemma_and_parts = HitCounter()
-
-    for i in range(0, len(top_verbs)):
-        wd, count = top_verbs[i]
-        chapt, sent = counter._first_context_by_word[wd]
-        all_lemmas = lemma_lookup.get_lemmas(wd)
-
-        """Do two things:
-        First, remove the person from the parts
-        Next, create a list of the most common verb + parts
-        AND a list of the most common parts
-        Remember where they come from (wd, chapt, sent) as well as the lemma and parts
-        """
-        verb_lemas = [x for x in all_lemmas if x['type'] == 'verb']
-        context = f"{wd}:{count}/{chapt}: {sent}"
-        if len(verb_lemas) > 0:
-            verb_lemma = verb_lemas[0]  # just use the first to keep things simple.
-            parts = verb_lemma['parts']
-            if len(parts) == 0:
-                parts = ['infinitive']
-            parts_key = unpersonal_parts(verb_lemma['parts'])
-            uses_by_parts.add_hit(parts_key, context)
-            uses_by_lemma_and_parts.add_hit(verb_lemma['lemma'] + ":" + parts_key, context)
-    # now print the results
-    print("top usage by parts")
-    uses_by_parts.dump(1000)
-
-    print("top usage by parts and lemma")
-    uses_by_lemma_and_parts.dump(100)
-
-
-class HitCounter:
     def __init__(self):
         self.hits_by_key = {}
 
-    def add_hit(self, key:str, context:str):
-        if key in self.hits_by_key:
-            self.hits_by_key[key]['hits'] += 1
-        else:
-            self.hits_by_key[key] = {'hits': 1, 'first_context': context}
+    def add_hit(self, key: str, context: str, order: Optional[Tuple] = None, hits: int = 1):
+        entry = self.hits_by_key.get(key, None)
+        if entry is None:
+            self.hits_by_key[key] = {'hits': hits, 'first_context': context, 'first_order': order}
+            return
+        entry['hits'] += hits
+        if (order is not None) and ((entry.get('first_order', None) is None) or (order < entry['first_order'])):
+            entry['first_context'] = context
+            entry['first_order'] = order
+
+    def merge(self, other: "HitCounter"):
+        """
+        Add the hits of another counter. Keys without an order keep the context of this counter.
+        """
+        for key, entry in other.hits_by_key.items():
+            self.add_hit(key, entry['first_context'], entry.get('first_order', None), entry['hits'])
+
+    def subtract(self, other: "HitCounter"):
+        """
+        Take away the hits of another counter. Keys left with no hits are removed, first contexts are kept.
+        """
+        for key, entry in other.hits_by_key.items():
+            if key in self.hits_by_key:
+                self.hits_by_key[key]['hits'] -= entry['hits']
+                if self.hits_by_key[key]['hits'] <= 0:
+                    del self.hits_by_key[key]
 
     def dump(self, max_entries):
         hits_and_context = [(x['hits'], x['first_context'], k) for k, x in self.hits_by_key.items()]
@@ -2,12 +2,17 @@ import os
 import pickle
 import re
 import urllib
-from typing import Optional
+from typing import Dict, Optional
 
+from key_value_store import KeyValueStore, get_store_path, migrate_pickle
 from my_wiktionary_parser import MyWiktionaryParser as WiktionaryParser
 from util import language_to_code
 from pickling_base import PicklingBaseClass
 
+# fetched pages are written to the cache file at least this often, so a crash loses at most this many seconds of
+# fetches
+FLUSH_SECONDS = 5.0
+
 
 def should_skip_lemma(lemma: str):
     # most_frequent_lemmas = ['sobre', 'eria', 'illo', 'miento', 'mente', 'ería', 'mente', 'illo', 'eria']
@@ -17,6 +22,13 @@ def should_skip_lemma(lemma: str):
 
 
 class WiktionaryCache(PicklingBaseClass):
+    """
+    Wiktionary pages fetched so far, saved in cache/<language>/WiktionaryCache.sqlite.
+    definitions, sources and wiktionary_cache (used by MyWiktionaryParser.fetch_recursive) are each a table,
+    read one key at a time. New entries are written behind, in batches, every FLUSH_SECONDS and at exit.
+    Tables are opened when they are first used, and the parser when a page has to be fetched, so loading the cache
+    takes the same time however many pages it holds.
+    """
     lemma_parts_re = r"(From )?(([a-zA-Z0-9À-ž]+-?( \(\“.+\”\))?)( \+‎ -?[a-zA-Z0-9À-ž]*-?)+)(;.*)?"
     from_or_see_re = r"(Diminutive of|From|See|From the [a-zA-Z0-9À-ž]+) ([a-zA-Z0-9À-ž]+)( *\(.*\))*.?$"
     past_participle_re = r"(Past participle|Clipping|From the participle) of ([a-zA-Z0-9À-ž]+)"
@@ -25,36 +37,54 @@ class WiktionaryCache(PicklingBaseClass):
 
     def __init__(self, language):
         self.lang_code = language_to_code(language)
-        self.parser = WiktionaryParser()
-        self.parser.set_default_language(language)
-        self.parser.exclude_relation("related terms")
-        self.definitions = {}
-        self.sources = {}
+        self._parser: Optional[WiktionaryParser] = None
+        # table name -> store, opened when the table is first used
+        self._stores: Dict[str, KeyValueStore] = {}
         self.dirty_count = 0
         super().__init__(language)
 
-    def __getstate__(self):
-        state = self.__dict__.copy()
-        # Don't pickle baz
-        del state["parser"]
-        del state['dirty_count']
-        return state
-
-    def __setstate__(self, state):
-        self.sources = {}  # in case we don't have it yet
-        self.__dict__.update(state)
-        # Add baz back since it doesn't exist in the pickle
-        self.parser = WiktionaryParser()
-        self.parser.set_default_language(self.language)
-        self.parser.exclude_relation("related terms")
+    @property
+    def parser(self) -> WiktionaryParser:
+        # the parser opens the http cache, which isn't needed while every page asked for is already cached
+        if self._parser is None:
+            self._parser = WiktionaryParser()
+            self._parser.set_default_language(self.language)
+            self._parser.exclude_relation("related terms")
+        return self._parser
+
+    def _get_store(self, table: str) -> KeyValueStore:
+        store = self._stores.get(table, None)
+        if store is None:
+            store = KeyValueStore(get_store_path(self.language, 'WiktionaryCache'), table, FLUSH_SECONDS)
+            self._stores[table] = store
+        return store
+
+    @property
+    def definitions(self) -> KeyValueStore:
+        return self._get_store('definitions')
+
+    @property
+    def sources(self) -> KeyValueStore:
+        return self._get_store('sources')
+
+    @property
+    def wiktionary_cache(self) -> KeyValueStore:
+        return self._get_store('wiktionary_cache')
+
+    def save(self):
+        for store in self._stores.values():
+            store.flush()
         self.dirty_count = 0
 
     def bump_dirty(self):
+        # called by MyWiktionaryParser after it adds to wiktionary_cache
         self.dirty_count += 1
-        if self.dirty_count >= 20:
-            self.save()
-            print("-- save --")
-            self.dirty_count = 0
+
+    def _migrate(self, old: "WiktionaryCache"):
+        # old is unpickled without __init__, so its tables are read from its __dict__, not through the properties
+        self.definitions.set_many(old.__dict__.get('definitions', {}).items())
+        self.sources.set_many(old.__dict__.get('sources', {}).items())
+        self.wiktionary_cache.set_many(old.__dict__.get('wiktionary_cache', {}).items())
 
     def define_full_2(self, max_defs: int, base: str, lemma: Optional[str]) -> str:
         definitions = self.parser.fetch_recursive(max_defs, base, lemma, self.language, self)
@@ -117,7 +147,9 @@ class WiktionaryCache(PicklingBaseClass):
 
     @staticmethod
     def load(language: str) -> 'WiktionaryCache':
-        return PicklingBaseClass.s_load(language, WiktionaryCache)
+        cache = WiktionaryCache(language)
+        migrate_pickle(PicklingBaseClass.s_get_cache_path(language, WiktionaryCache), cache._migrate)
+        return cache
 
 
     """
@@ -228,18 +260,20 @@ class WiktionaryCache(PicklingBaseClass):
     def define(self, term: str, source: str) -> str:
         if len(source) > 0:
             key = term.lower()
-            if key not in self.sources:
-                self.sources[key] = set()
-            self.sources[key].add(source.lower())
-        if term not in self.definitions:
+            # values read from the store are copies, so the set is written back when it changes
+            sources = self.sources.get(key, set())
+            if source.lower() not in sources:
+                sources.add(source.lower())
+                self.sources[key] = sources
+        data = self.definitions.get(term, None)
+        if data is None:
             print("define", term)
             data = self.parser.fetch(term)
             self.definitions[term] = data
-            self.save()
 
         # import pprint
-        # pprint.pprint(self.definitions[term])
-        return self.to_html(self.definitions[term], term)
+        # pprint.pprint(data)
+        return self.to_html(data, term)
 
 
 def find_most_common_lemmas(wc: WiktionaryCache):
@@ -119,16 +119,16 @@ def _add_token_emphasis(text: str, token_text_set: {str}, nlp: SpacyLanguage) ->
     # words = nltk.word_tokenize(raw_sentence)
     # print("add_token_emphasis", text)
 
-    doc = nlp(text)
+    # only token texts are needed, so the tokenizer is enough and the sentence is never parsed
+    doc = nlp.make_doc(text)
     matches = []
     seen = {}
     output = ""
-    for sent in doc.sents:
-        for token in sent:
-            if token.text in token_text_set:
-                if not token.text in seen:
-                    matches.append(token.text)
-                seen[token.text] = True
+    for token in doc:
+        if token.text in token_text_set:
+            if not token.text in seen:
+                matches.append(token.text)
+            seen[token.text] = True
 
     output = ""
 